@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+"""
+Check of the conditional requests of remote.RemoteVersion.
+
+Fetches the remote version twice from the commits stub of the scan
+benchmark, which sends an ETag. The second fetch has to send it back as
+If-None-Match, get a 304 Not Modified without a body and go over the
+kept-alive connection of the first one. Exits non-zero if it doesn't.
+
+    python bench/remote_check.py
+"""
+
+import http.server
+import sys
+import threading
+
+import scan_benchmark
+
+sys.path.insert(0, scan_benchmark.SOURCE_DIR)
+
+import remote
+
+
+class RecordingHandler(scan_benchmark.CommitsHandler):
+    # connections accepted and (If-None-Match, status) of every request
+    connections = 0
+    requests: list[tuple[str | None, int]] = []
+
+    def setup(self):
+        super().setup()
+        RecordingHandler.connections += 1
+
+    def send_response(self, code, message=None):
+        RecordingHandler.requests.append((self.headers.get("If-None-Match"), code))
+        super().send_response(code, message)
+
+
+class RecordingRemoteVersion(remote.RemoteVersion):
+    def __init__(self, *arguments, **options):
+        super().__init__(*arguments, **options)
+        # (status, body) of every answer
+        self.answers: list[tuple[int, bytes]] = []
+
+    def request(self):
+        response, body = super().request()
+        self.answers.append((response.status, body))
+        return response, body
+
+
+def main():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RecordingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    remote_version = RecordingRemoteVersion(f"http://127.0.0.1:{server.server_port}/api/v4/projects/1/repository/commits", timeout=5)
+    try:
+        versions = [remote_version.fetch(), remote_version.fetch()]
+    finally:
+        remote_version.close()
+        server.shutdown()
+
+    etag = RecordingHandler.ETAG
+    checks = [
+        ("both fetches report the version", versions == [RecordingHandler.VERSION] * 2),
+        ("the first request is unconditional", RecordingHandler.requests[:1] == [(None, 200)]),
+        ("the second request sends the ETag back", RecordingHandler.requests[1:] == [(etag, 304)]),
+        ("the 304 has no body", [body for status, body in remote_version.answers if status == 304] == [b""]),
+        ("both requests share one connection", RecordingHandler.connections == 1),
+        ]
+    for description, passed in checks:
+        print(f"{'ok' if passed else 'FAILED':<6} {description}")
+    sys.exit(0 if all(passed for _, passed in checks) else 1)
+
+
+if __name__ == "__main__":
+    main()
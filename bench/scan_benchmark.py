@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+"""
+Scan benchmark with simulated hosts.
+
+Runs a full `fleet` scan against fleets of simulated machines and reports
+wall time, peak threads, peak child processes, peak RSS and the CPU time
+spent rendering the dashboard. Every fleet size runs in its own interpreter
+so module state and peak RSS don't leak between sizes.
+
+    python bench/scan_benchmark.py
+    python bench/scan_benchmark.py --sizes 10 100 --mode exec --latency 0.2
+
+--mode inprocess answers every command inside the event loop, it measures
+the scan and render machinery without process start-up costs. --mode exec
+puts the stand-in `ssh` and `ping` executables from bench/fakes first on
+PATH, so every query is a real process like in production. The remote
+version is served by a local HTTP stub in both modes.
+"""
+
+import argparse
+import asyncio
+import http.server
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.join(os.path.dirname(BENCH_DIR), "src")
+
+SIZES = [10, 100, 1000, 5000]
+SAMPLE_INTERVAL = 0.01
+
+
+class CommitsHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    VERSION = "26fb48b5"
+    ETAG = f'"{VERSION}"'
+
+    def do_GET(self):
+        if self.headers.get("If-None-Match") == self.ETAG:
+            # like GitLab, an unchanged repository is headers only
+            self.send_response(304)
+            self.send_header("ETag", self.ETAG)
+            self.end_headers()
+            return
+        body = json.dumps([{"short_id": self.VERSION}]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", self.ETAG)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *arguments):
+        pass
+
+
+def start_stub_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), CommitsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def child_processes():
+    """
+    Number of direct children of this process, read from /proc.
+    """
+    pid = str(os.getpid())
+    count = 0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                # the command name may contain spaces, the ppid follows its closing parenthesis
+                if stat.read().rsplit(")", 1)[1].split()[1] == pid:
+                    count += 1
+        except (OSError, IndexError):
+            continue
+    return count
+
+
+def in_process_scanner(scan, simulated):
+    class SimulatedScanner(scan.Scanner):
+        async def exec(self, command, stdout=subprocess.PIPE, stderr=subprocess.PIPE):
+            async with self.slots:
+                returncode, out, err, seconds = simulated.respond(command)
+                if seconds is None:
+                    await asyncio.sleep(self.timeout)
+                    raise TimeoutError
+                await asyncio.wait_for(asyncio.sleep(seconds), self.timeout)
+            if hasattr(stderr, "write"):
+                # a file like the one a detaching master connection gets
+                stderr.write(err.encode())
+                err = ""
+            return subprocess.CompletedProcess(command, returncode, out, err)
+
+    return SimulatedScanner
+
+
+def run_one(arguments):
+    """
+    Benchmark a single fleet size in this interpreter, prints a JSON result.
+    """
+    machines = [f"host-{index:05}" for index in range(arguments.size)]
+    server = start_stub_server()
+    os.environ["FLEET_BENCH_LATENCY"] = str(arguments.latency)
+    os.environ["FLEET_BENCH_JITTER"] = str(arguments.jitter)
+    os.environ["FLEET_BENCH_FAILURE_RATE"] = str(arguments.failure_rate)
+    os.environ["FLEET_BENCH_OFFLINE_RATE"] = str(arguments.offline_rate)
+    os.environ["FLEET_BENCH_HUNG_RATE"] = str(arguments.hung_rate)
+    os.environ["FLEET_BENCH_THROTTLE_RATE"] = str(arguments.throttle_rate)
+    if arguments.mode == "exec":
+        os.environ["PATH"] = os.path.join(BENCH_DIR, "fakes") + os.pathsep + os.environ["PATH"]
+
+    sys.path.insert(0, SOURCE_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    import fleet
+    import remote
+    import scan
+    import simulated
+
+    if arguments.mode == "inprocess":
+        scan.Scanner = in_process_scanner(scan, simulated)
+
+    fleet.configure(machines, f"http://127.0.0.1:{server.server_port}/api/v4/projects/fleet/repository/commits")
+
+    scan_arguments = fleet.parse_arguments([
+        "--ping",
+        "--no-cache",
+        "--concurrency", str(arguments.concurrency),
+        "--timeout", str(arguments.timeout),
+        "--deadline", str(arguments.deadline),
+        ])
+    remote_version = remote.RemoteVersion(fleet.URL, None, arguments.timeout)
+
+    peaks = {"threads": 0, "processes": 0}
+    sampling = True
+
+    def sample():
+        while sampling:
+            peaks["threads"] = max(peaks["threads"], threading.active_count())
+            peaks["processes"] = max(peaks["processes"], child_processes())
+            time.sleep(SAMPLE_INTERVAL)
+
+    render_cpu = {}
+
+    def render():
+        fleet.print_text(fleet.render.MAX_FPS, io.StringIO())
+        render_cpu["seconds"] = time.thread_time()
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    renderer = threading.Thread(target=render, daemon=True)
+    sampler.start()
+    renderer.start()
+
+    start = time.perf_counter()
+    asyncio.run(fleet.scan_fleet(scan_arguments, machines, remote_version))
+    wall = time.perf_counter() - start
+
+    fleet.DONE = True
+    renderer.join()
+    sampling = False
+    sampler.join()
+
+    states = {}
+    for machine in machines:
+        automation_status = fleet.STATE.get(machine, "automation_status")
+        states[automation_status] = states.get(automation_status, 0) + 1
+
+    rss_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss_kib = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    print(json.dumps({
+        "size": arguments.size,
+        "mode": arguments.mode,
+        "wall_seconds": round(wall, 3),
+        "peak_threads": peaks["threads"],
+        "peak_processes": peaks["processes"],
+        "peak_rss_mib": round(rss_kib / 1024, 1),
+        "peak_child_rss_mib": round(children_rss_kib / 1024, 1),
+        "render_cpu_seconds": round(render_cpu.get("seconds", 0), 3),
+        "automation_status": states,
+        }))
+
+
+def run_all(arguments):
+    results = []
+    for size in arguments.sizes:
+        command = [sys.executable, os.path.abspath(__file__), "--size", str(size)]
+        for option in ["mode", "latency", "jitter", "failure_rate", "offline_rate", "hung_rate", "throttle_rate", "concurrency", "timeout", "deadline"]:
+            command += ["--" + option.replace("_", "-"), str(getattr(arguments, option))]
+        output = subprocess.run(command, capture_output=True, text=True)
+        if output.returncode != 0:
+            sys.stderr.write(output.stderr)
+            sys.exit(output.returncode)
+        results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    if arguments.json:
+        for result in results:
+            print(json.dumps(result))
+        return
+
+    print(f"{'machines':>8} {'wall s':>8} {'threads':>8} {'procs':>6} {'rss MiB':>8} {'render s':>9}")
+    for result in results:
+        print(f"{result['size']:>8} {result['wall_seconds']:>8.2f} {result['peak_threads']:>8} {result['peak_processes']:>6} {result['peak_rss_mib']:>8.1f} {result['render_cpu_seconds']:>9.2f}")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark fleet scans against simulated hosts.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help=f"fleet sizes to benchmark (default: {SIZES})")
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--mode", choices=["inprocess", "exec"], default="inprocess", help="answer commands in-process or through stand-in executables (default: inprocess)")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds each simulated command takes (default: 0.05)")
+    parser.add_argument("--jitter", type=float, default=0.02, help="random +- seconds added to the latency (default: 0.02)")
+    parser.add_argument("--failure-rate", type=float, default=0.02, help="share of hosts whose ssh commands fail (default: 0.02)")
+    parser.add_argument("--offline-rate", type=float, default=0.05, help="share of hosts that don't answer ping (default: 0.05)")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of new ssh connections dropped like by sshd's MaxStartups, retried by the scanner (default: 0)")
+    parser.add_argument("--hung-rate", type=float, default=0.01, help="share of hosts whose ssh commands never return (default: 0.01)")
+    parser.add_argument("--concurrency", type=int, default=64, help="fleet --concurrency (default: 64)")
+    parser.add_argument("--timeout", type=float, default=2, help="fleet --timeout (default: 2)")
+    parser.add_argument("--deadline", type=float, default=120, help="fleet --deadline (default: 120)")
+    parser.add_argument("--json", action="store_true", help="print one JSON result per size")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    if arguments.size is not None:
+        run_one(arguments)
+    else:
+        run_all(arguments)
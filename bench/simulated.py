@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+"""
+Simulated hosts for the scan benchmark.
+
+Every host answers `ssh`/`ping` commands with canned output like the samples
+in .dev_docs/commands.txt. Latency, jitter, failures and hung hosts are
+drawn from a random generator seeded with the host name, so every run sees
+the same fleet.
+"""
+
+import json
+import os
+import random
+import time
+import zlib
+
+LATENCY = 0.05
+JITTER = 0.02
+FAILURE_RATE = 0.02
+OFFLINE_RATE = 0.05
+HUNG_RATE = 0.01
+# share of new connections dropped like sshd's MaxStartups does, drawn
+# anew for every connection so retries can get through
+THROTTLE_RATE = 0.0
+SEED = 0
+
+SYSTEMCTL_STATUS = """\
+○ nixos-upgrade.service - NixOS Upgrade
+     Loaded: loaded (/etc/systemd/system/nixos-upgrade.service; linked; preset: enabled)
+     Active: inactive (dead) since Fri 2023-08-04 19:42:11 CEST; 2 days ago
+TriggeredBy: ● nixos-upgrade.timer
+"""
+
+SYSTEMCTL_STATUS_FAILED = SYSTEMCTL_STATUS.replace("inactive (dead)", "failed (Result: exit-code)")
+
+NIXOS_VERSION = {
+    "configurationRevision": "26fb48b5e18920cafc80c54ab8b447fb178903ed",
+    "nixosVersion": "23.05.20230803.e9ca92b",
+    "nixpkgsRevision": "e9ca92b55bed47696cc7cc25d3f854a1e2e01f86",
+    }
+
+LS_LINE = "lrwxrwxrwx 1 root root 15 {date} /nix/var/nix/profiles/system -> system-{generation}-link"
+
+
+class Host:
+    """
+    Behaviour of one simulated machine.
+    """
+
+    def __init__(self, name, latency=LATENCY, jitter=JITTER, failure_rate=FAILURE_RATE, offline_rate=OFFLINE_RATE, hung_rate=HUNG_RATE, seed=SEED):
+        self.name = name
+        self.random = random.Random(zlib.crc32(name.encode()) + seed)
+        self.latency = latency
+        self.jitter = jitter
+        draw = self.random.random()
+        self.hung = draw < hung_rate
+        self.offline = hung_rate <= draw < hung_rate + offline_rate
+        self.failing = hung_rate + offline_rate <= draw < hung_rate + offline_rate + failure_rate
+        self.build_failed = self.random.random() < 0.1
+        self.generation = self.random.randint(1, 999)
+        self.build_time = time.time() - self.random.randint(600, 10 * 86400)
+        # StateChangeTimestampMonotonic of nixos-upgrade.service
+        self.state_change = self.random.randint(10 ** 9, 10 ** 12)
+
+    def delay(self):
+        return max(0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def ping(self):
+        """
+        Returns (returncode, stdout, stderr, seconds), seconds is None for
+        hosts that never answer.
+        """
+        if self.offline:
+            return 1, "", "", self.delay()
+        return 0, "1 packets transmitted, 1 received\n", "", self.delay()
+
+    def ssh(self, command):
+        if self.hung:
+            return 0, "", "", None
+        if self.offline:
+            return 255, "", f"ssh: connect to host {self.name} port 22: No route to host\n", self.delay()
+        if self.failing:
+            return 255, "", f"Connection closed by {self.name} port 22\n", self.delay()
+        return 0, self.output(command), "", self.delay()
+
+    def fingerprint(self):
+        return f"system-{self.generation}-link /nix/store/{self.generation:032}-nixos-system {self.state_change}"
+
+    def output(self, command):
+        date = time.strftime("%Y-%m-%d %H:%M", time.localtime(self.build_time))
+        if command.startswith("sh -c") and "load_state" not in command:
+            return self.fingerprint() + "\n"
+        if command.startswith("sh -c"):
+            return json.dumps({
+                "load_state": "loaded",
+                "active_state": "failed" if self.build_failed else "inactive",
+                "nixos_version": NIXOS_VERSION,
+                "profile_link": f"system-{self.generation}-link",
+                "profile_mtime": int(self.build_time),
+                "fingerprint": self.fingerprint(),
+                }) + "\n"
+        if command.startswith("systemctl status"):
+            return SYSTEMCTL_STATUS_FAILED if self.build_failed else SYSTEMCTL_STATUS
+        if command.startswith("nixos-version"):
+            return json.dumps(NIXOS_VERSION) + "\n"
+        if command.startswith("ls"):
+            return LS_LINE.format(date=date, generation=self.generation) + "\n"
+        if command.startswith("readlink"):
+            return f"system-{self.generation}-link\n"
+        return ""
+
+
+def host_from_environment(name):
+    """
+    Stand-in executables get their settings through FLEET_BENCH_* variables.
+    """
+    return Host(
+        name,
+        latency=float(os.environ.get("FLEET_BENCH_LATENCY", LATENCY)),
+        jitter=float(os.environ.get("FLEET_BENCH_JITTER", JITTER)),
+        failure_rate=float(os.environ.get("FLEET_BENCH_FAILURE_RATE", FAILURE_RATE)),
+        offline_rate=float(os.environ.get("FLEET_BENCH_OFFLINE_RATE", OFFLINE_RATE)),
+        hung_rate=float(os.environ.get("FLEET_BENCH_HUNG_RATE", HUNG_RATE)),
+        seed=int(os.environ.get("FLEET_BENCH_SEED", SEED)),
+        )
+
+
+def parse_ssh_arguments(arguments):
+    """
+    Split an ssh argument list into (options, machine, command).
+    """
+    options = []
+    index = 0
+    while index < len(arguments) and arguments[index].startswith("-"):
+        option = arguments[index]
+        if option in ["-o", "-O", "-p", "-i", "-J", "-l"]:
+            options.append((option, arguments[index + 1]))
+            index += 2
+        else:
+            options.append((option, None))
+            index += 1
+    machine = arguments[index]
+    command = " ".join(arguments[index + 1:])
+    return options, machine, command
+
+
+def throttled():
+    rate = float(os.environ.get("FLEET_BENCH_THROTTLE_RATE", THROTTLE_RATE))
+    return random.random() < rate
+
+
+def respond(arguments):
+    """
+    Answer a command line as run by `scan.Scanner.exec`.
+    """
+    program = os.path.basename(arguments[0])
+    if program == "ping":
+        return host_from_environment(arguments[-1]).ping()
+    if program == "ssh":
+        options, machine, command = parse_ssh_arguments(arguments[1:])
+        host = host_from_environment(machine)
+        flags = [option for option, _ in options]
+        control_path = None
+        for option, value in options:
+            if option == "-o" and value.startswith("ControlPath="):
+                control_path = value.split("=", 1)[1]
+        if "-G" in flags:
+            # evaluated ssh_config, no jump hosts in the simulation
+            return 0, f"hostname {machine}\nport 22\nproxyjump none\n", "", 0
+        if "-O" in flags:
+            # control commands for the master connection
+            if control_path and os.path.exists(control_path):
+                os.unlink(control_path)
+            return 0, "", "", 0
+        multiplexed = control_path is not None and os.path.exists(control_path)
+        if not multiplexed and throttled():
+            return 255, "", "kex_exchange_identification: read: Connection reset by peer\n", 0.01
+        if "-N" in flags:
+            # opening a master connection costs one handshake
+            returncode, _, stderr, seconds = host.ssh("true")
+            if returncode == 0 and seconds is not None and control_path:
+                open(control_path, "w").close()
+            return returncode, "", stderr, seconds
+        return host.ssh(command)
+    return 127, "", f"{program}: not simulated\n", 0
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""
+Startup benchmark.
+
+Starts `fleet` as a fresh process and measures how long it takes until the
+first complete frame of the dashboard (the empty table) is on stdout, and
+how long `fleet --help` takes without any configuration. The simulated
+hosts from bench/fakes answer slowly enough that the scan is still running
+when the first frame arrives.
+
+    python bench/startup_benchmark.py
+    python bench/startup_benchmark.py --sizes 10 1000 --runs 20
+"""
+
+import argparse
+import json
+import os
+import select
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FLEET = os.path.join(os.path.dirname(BENCH_DIR), "src", "fleet.py")
+
+SIZES = [10, 100, 1000]
+RUNS = 10
+# the bottom right corner of the table ends a frame
+FRAME_END = "╯".encode()
+
+
+def environment(size):
+    env = dict(os.environ)
+    env["FLEET_MACHINES"] = " ".join(f"host-{index:05}" for index in range(size))
+    # nothing listens there, the scan keeps running until the deadline
+    env["FLEET_REPO_URL"] = "http://127.0.0.1:9/api/v4/projects/fleet/repository/commits"
+    env["FLEET_BENCH_LATENCY"] = "5"
+    env["PATH"] = os.path.join(BENCH_DIR, "fakes") + os.pathsep + env["PATH"]
+    return env
+
+
+def time_to_first_frame(size, timeout):
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, FLEET, "--no-cache", "--ping"],
+        env=environment(size),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+        )
+    output = b""
+    try:
+        while FRAME_END not in output:
+            remaining = timeout - (time.perf_counter() - start)
+            if remaining <= 0 or not select.select([process.stdout], [], [], remaining)[0]:
+                return None
+            chunk = os.read(process.stdout.fileno(), 65536)
+            if not chunk:
+                return None
+            output += chunk
+        return time.perf_counter() - start
+    finally:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+def time_help():
+    env = {key: value for key, value in os.environ.items() if not key.startswith("FLEET_")}
+    start = time.perf_counter()
+    subprocess.run([sys.executable, FLEET, "--help"], env=env, stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def time_interpreter():
+    # the floor: starting python itself
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return time.perf_counter() - start
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the time until fleet shows its first frame.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help=f"fleet sizes to benchmark (default: {SIZES})")
+    parser.add_argument("--runs", type=int, default=RUNS, help=f"runs per measurement, the median is reported (default: {RUNS})")
+    parser.add_argument("--timeout", type=float, default=10, help="seconds to wait for the first frame (default: 10)")
+    parser.add_argument("--json", action="store_true", help="print one JSON result per measurement")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    results = [
+        {"measurement": "python -c pass", "seconds": statistics.median(time_interpreter() for _ in range(arguments.runs))},
+        {"measurement": "fleet --help", "seconds": statistics.median(time_help() for _ in range(arguments.runs))},
+        ]
+    for size in arguments.sizes:
+        times = [time_to_first_frame(size, arguments.timeout) for _ in range(arguments.runs)]
+        if None in times:
+            sys.exit(f"no frame within {arguments.timeout}s for {size} machines")
+        results.append({"measurement": f"first frame, {size} machines", "seconds": statistics.median(times)})
+
+    if arguments.json:
+        for result in results:
+            print(json.dumps(result))
+    else:
+        for result in results:
+            print(f"{result['measurement']:<28} {result['seconds'] * 1000:>8.1f} ms")
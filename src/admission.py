@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import contextlib
+import random
+
+import lazy
+import timing
+
+asyncio = lazy.load("asyncio")
+
+# connections being set up at the same time to one machine and through one
+# jump host, sshd's default MaxStartups (10:30:100) starts dropping at 10
+STARTS_PER_HOST = 2
+STARTS_PER_JUMP_HOST = 8
+# seconds between two connection starts through the same jump host or to
+# the same machine, varied by +-JITTER so bursts don't line up
+SPACING = 0.02
+JITTER = 0.5
+# retries of a connection start that was dropped by throttling
+RETRIES = 3
+# seconds before the first retry, doubled for every further one
+BACKOFF = 0.5
+
+# what ssh prints when sshd drops a connection before the key exchange,
+# which is what MaxStartups and similar rate limits do
+THROTTLED = [
+    "kex_exchange_identification",
+    "ssh_exchange_identification",
+    "Connection reset by peer",
+    "Connection closed by remote host",
+    ]
+
+
+def is_throttled(output):
+    """
+    Whether a failed ssh call was dropped by a connection limit rather than
+    failing for real (host down, authentication, the command itself).
+    """
+    return output.returncode == 255 and any(marker in output.stderr for marker in THROTTLED)
+
+
+class Admission:
+    """
+    Limits how many ssh connections are being set up at once, per machine
+    and per jump host, and spreads their starts out in time.
+
+    Only connection starts go through here: opening a master connection, or
+    a command that can't use one. Commands over an open master connection
+    don't cost the server a new handshake.
+    """
+
+    def __init__(self, per_host=STARTS_PER_HOST, per_jump_host=STARTS_PER_JUMP_HOST, spacing=SPACING, retries=RETRIES, seed=None):
+        self.per_host = per_host
+        self.per_jump_host = per_jump_host
+        self.spacing = spacing
+        self.retries = retries
+        self.random = random.Random(seed)
+        self.host_starts: dict[str, asyncio.Semaphore] = {}
+        self.jump_host_starts: dict[str, asyncio.Semaphore] = {}
+        # earliest time of the next start, per machine and per jump host
+        self.next_start: dict[str, float] = {}
+
+    def semaphore(self, semaphores, key, limit):
+        if key not in semaphores:
+            semaphores[key] = asyncio.Semaphore(limit)
+        return semaphores[key]
+
+    async def space(self, key):
+        # every start books the next free point in time for its key
+        now = asyncio.get_running_loop().time()
+        start = max(now, self.next_start.get(key, now))
+        self.next_start[key] = start + self.spacing * self.random.uniform(1 - JITTER, 1 + JITTER)
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, host, jump_host=None):
+        """
+        Held while a connection to `host` (through `jump_host`) is set up.
+        """
+        async with self.semaphore(self.host_starts, host, self.per_host):
+            if jump_host is None:
+                await self.space(host)
+                yield
+                return
+            async with self.semaphore(self.jump_host_starts, jump_host, self.per_jump_host):
+                await self.space(jump_host)
+                yield
+
+    def backoff(self, attempt):
+        return BACKOFF * 2 ** attempt * self.random.uniform(1 - JITTER, 1 + JITTER)
+
+    async def run(self, start, host, jump_host=None):
+        """
+        Await `start()`, a coroutine starting an ssh connection that returns
+        a CompletedProcess, inside a slot. Calls dropped by throttling are
+        retried after a growing, jittered pause, recorded in `timing` as
+        "ssh_backoff".
+        """
+        attempt = 0
+        while True:
+            async with self.slot(host, jump_host):
+                output = await start()
+            if attempt >= self.retries or not is_throttled(output):
+                return output
+            with timing.measure(host, "ssh_backoff"):
+                await asyncio.sleep(self.backoff(attempt))
+            attempt += 1
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+"""
+Status agent, `fleet --agent`.
+
+Runs on the machine itself and keeps a small status document at
+commands.STATUS_PATH up to date. Dashboards read that one file instead of
+probing the machine, see scan.Scanner.status_payload.
+
+Run it from a systemd timer, more often than --status-max-age, and from a
+unit of its own that nixos-upgrade.service starts once it is done, through
+OnSuccess= and OnFailure=. Not as ExecStartPost= of nixos-upgrade.service:
+that oneshot unit is still activating then, which the document would keep
+as an unknown automation status, and it never runs after a failed build.
+
+    {"time": <epoch>, "automation_status": "automated",
+     "configuration_revision": "<sha>", "generation": "42",
+     "build_time": <epoch>}
+"""
+
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+import commands
+
+# rewrite an unchanged document after this many seconds, so it doesn't turn stale
+REFRESH = commands.STATUS_MAX_AGE // 2
+
+
+def collect(timeout=commands.COMMAND_TIMEOUT, now=None):
+    output = subprocess.run(commands.PROBE_COMMAND, capture_output=True, text=True, timeout=timeout)
+    return commands.status_document(json.loads(output.stdout.strip()), time.time() if now is None else now)
+
+
+def read(path):
+    try:
+        with open(path) as status_file:
+            document = json.load(status_file)
+    except (OSError, ValueError):
+        return None
+    return document if isinstance(document, dict) else None
+
+
+def write(path, document):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # replaced in one step, a dashboard never reads half a document
+    descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".status-")
+    try:
+        with os.fdopen(descriptor, "w") as status_file:
+            json.dump(document, status_file)
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, path)
+    except OSError:
+        os.unlink(temporary_path)
+        raise
+
+
+def update(path=commands.STATUS_PATH, refresh=REFRESH):
+    """
+    Write a new status document if anything changed or the current one is
+    older than `refresh` seconds, returns whether it was written.
+    """
+    document = collect()
+    previous = read(path)
+    if previous is not None:
+        unchanged = all(previous.get(key) == value for key, value in document.items() if key != "time")
+        if unchanged and document["time"] - previous.get("time", 0) < refresh:
+            return False
+    write(path, document)
+    return True
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+
+"""
+Scanning machines from other programs, without the dashboard.
+
+    import api
+
+    async for result in api.scan(["mario", "cosmo"], "https://gitlab.example.com/api/v4/projects/1/repository/commits"):
+        print(result.machine, result.nixos_version, result.nixos_version_match)
+
+Nothing here reads the environment or touches the terminal. The `fleet`
+dashboard and its --json output are built on the same functions, they only
+keep their results in a module-wide state.Store.
+"""
+
+import threading
+
+from datetime import datetime
+from typing import AsyncIterator, NamedTuple, TypedDict
+
+import commands
+import lazy
+import reachability
+import scan as scanning
+import state
+import timing
+
+asyncio = lazy.load("asyncio")
+remote = lazy.load("remote")
+
+# the specs a full probe reports
+PROBED = ["automation_status", "nixos_version", "generation", "last_build"]
+
+# values that don't name a version
+PLACEHOLDERS = ["unset", "unknown", "timeout", "none"]
+
+
+class Result(NamedTuple):
+    """
+    The specs of one machine, the fields of state.FIELDS, plus the remote
+    version they were compared against, when the system profile was built
+    (epoch seconds) and how many seconds the scan of the machine took. The
+    last two are None if unknown.
+    """
+    machine: str
+    is_online: str
+    automation_status: str
+    nixos_version: str
+    nixos_version_match: str
+    generation: str
+    last_build: str
+    remote_version: str
+    build_time: float | None = None
+    duration: float | None = None
+
+
+class Fingerprint(TypedDict):
+    fingerprint: str
+    build_time: float | None
+    specs: dict[str, str]
+
+
+def matched_specs(store, machine):
+    """
+    The specs of `machine` with nixos_version_match worked out, which no
+    scan fills in, as far as both versions are known.
+    """
+    specs = store.specs(machine)
+    nixos_version = specs["nixos_version"]
+    remote_version = store.remote_version
+    if specs["nixos_version_match"] == "unset" and nixos_version not in PLACEHOLDERS and remote_version not in PLACEHOLDERS:
+        specs["nixos_version_match"] = "true" if nixos_version == remote_version else "false"
+    return specs
+
+
+def result(store, machine, fingerprints=None, durations=None):
+    specs = matched_specs(store, machine)
+    remote_version = store.remote_version
+    build_time = None
+    known = (fingerprints or {}).get(machine)
+    if known is not None and specs["is_online"] == "true" and specs["last_build"] not in PLACEHOLDERS:
+        build_time = known["build_time"]
+    return Result(machine, *[specs[field] for field in state.FIELDS], remote_version, build_time, (durations or {}).get(machine))
+
+
+def mark_timeouts(store, machine):
+    # nixos_version_match is no query, it's only ever unset
+    store.replace(machine, "unset", "timeout", [field for field in state.FIELDS if field != "nixos_version_match"])
+
+
+async def in_daemon_thread(function):
+    """
+    Await `function()` running in a daemon thread. Unlike asyncio.to_thread,
+    a cancelled caller leaves the thread behind instead of waiting for it, so
+    a blocking call can't keep the program alive past its deadline.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def settle(method, value):
+        if not future.done():
+            method(value)
+
+    def run():
+        try:
+            outcome = (future.set_result, function())
+        except BaseException as e:
+            outcome = (future.set_exception, e)
+        try:
+            loop.call_soon_threadsafe(settle, *outcome)
+        except RuntimeError:
+            pass  # the loop is gone, nobody waits for the result anymore
+
+    threading.Thread(target=run, daemon=True).start()
+    return await future
+
+
+async def fetch_remote_version(store, remote_version):
+    try:
+        with timing.measure(remote_version.host, "remote_version"):
+            # http.client blocks, keep it off the event loop
+            store.set_remote_version(await in_daemon_thread(remote_version.fetch))
+    except TimeoutError:
+        store.set_remote_version("timeout")
+    except Exception:
+        store.set_remote_version("unknown")
+
+
+async def fetch_remote_version_until(store, remote_version, deadline=None):
+    try:
+        async with asyncio.timeout(deadline):
+            await fetch_remote_version(store, remote_version)
+    except TimeoutError:
+        store.set_remote_version("timeout")
+
+
+async def run_query(store, query, machine):
+    try:
+        store.set(machine, query.__name__, await query(machine))
+    except TimeoutError:
+        store.set(machine, query.__name__, "timeout")
+    except Exception:
+        store.set(machine, query.__name__, "unknown")
+
+
+async def online_status(scanner, store, machine):
+    try:
+        is_online = await scanner.is_online(machine)
+    except TimeoutError:
+        # whatever an earlier scan left in the store is stale now
+        store.update(machine, {"is_online": "timeout", **{query: "timeout" for query in PROBED}})
+        return False
+    except Exception:
+        is_online = False
+    if not is_online:
+        store.update(machine, {
+            "is_online": "false",
+            "automation_status": "none",
+            "nixos_version": "none",
+            "nixos_version_match": "none",
+            "generation": "none",
+            "last_build": "none",
+            })
+    else:
+        store.set(machine, "is_online", "true")
+    return is_online
+
+
+async def reuse_specs(scanner, store, machine, fingerprints):
+    """
+    Fill in the specs of the last full probe if the fingerprint of the
+    machine is still the same, returns whether it did. Only `last_build`
+    moves on by itself, it's worked out again from the stored build time.
+    """
+    known = fingerprints.get(machine)
+    if known is None:
+        return False
+    if await scanner.fingerprint(machine) != known["fingerprint"]:
+        return False
+    specs = dict(known["specs"])
+    if known["build_time"] is not None:
+        specs["last_build"] = commands.build_age(datetime.fromtimestamp(known["build_time"]))
+    store.update(machine, specs)
+    return True
+
+
+def remember_fingerprint(fingerprints, machine, payload, specs):
+    fingerprint, build_time = commands.payload_change(payload)
+    if fingerprint is None:
+        fingerprints.pop(machine, None)
+    else:
+        fingerprints[machine] = {"fingerprint": fingerprint, "build_time": build_time, "specs": {query: specs[query] for query in PROBED}}
+
+
+async def machine_specs(scanner, store, machine, fingerprints=None, batch=True):
+    """
+    Scan one machine into `store`. With `fingerprints`, a dict of
+    Fingerprint by machine, only machines whose fingerprint changed are
+    probed in full. Without `batch` every spec is a query of its own.
+    """
+    if not await online_status(scanner, store, machine):
+        return
+
+    if batch:
+        try:
+            if fingerprints is None or not await reuse_specs(scanner, store, machine, fingerprints):
+                payload = await scanner.status_payload(machine)
+                specs = commands.payload_specs(payload)
+                if fingerprints is not None:
+                    remember_fingerprint(fingerprints, machine, payload, specs)
+                store.update(machine, specs)
+        except TimeoutError:
+            if fingerprints is not None:
+                fingerprints.pop(machine, None)
+            store.update(machine, {query: "timeout" for query in PROBED})
+        except Exception:
+            if fingerprints is not None:
+                fingerprints.pop(machine, None)
+            store.update(machine, {query: "unknown" for query in PROBED})
+        return
+
+    queries = [
+        scanner.automation_status,
+        scanner.nixos_version,
+        scanner.generation,
+        scanner.last_build,
+    ]
+    await asyncio.gather(*[run_query(store, query, machine) for query in queries])
+
+
+async def scan_machines(scanner, store, machines, remote_version=None, deadline=None, on_result=None, fingerprints=None, batch=True, durations=None):
+    """
+    Scan `machines` once into `store`, `on_result(machine)` is called as
+    soon as the specs of a machine are complete. Machines not done within
+    `deadline` seconds are marked as timed out. The seconds every finished
+    machine took go into `durations`, if given.
+    """
+    finished: set[str] = set()
+
+    async def scan_machine(machine):
+        start = asyncio.get_running_loop().time()
+        await machine_specs(scanner, store, machine, fingerprints, batch)
+        if durations is not None:
+            durations[machine] = asyncio.get_running_loop().time() - start
+        finished.add(machine)
+        if on_result is not None:
+            on_result(machine)
+
+    if scanner.reachability is None:
+        online_checks = []
+    else:
+        # check the whole fleet at once, the online column fills in within one timeout
+        online_checks = [online_status(scanner, store, machine) for machine in machines]
+    remote_versions = [] if remote_version is None else [fetch_remote_version(store, remote_version)]
+    try:
+        async with asyncio.timeout(deadline):
+            await asyncio.gather(
+                *online_checks,
+                scanner.for_each(machines, scan_machine),
+                *remote_versions,
+                )
+    except TimeoutError:
+        # out of time, keep what arrived and flag everything else as late
+        if remote_version is not None and store.remote_version == "unset":
+            store.set_remote_version("timeout")
+        for machine in machines:
+            mark_timeouts(store, machine)
+            if machine not in finished and on_result is not None:
+                on_result(machine)
+
+
+async def scan(
+        machines,
+        repo_url=None,
+        token=None,
+        *,
+        concurrency=scanning.CONCURRENCY,
+        per_host=scanning.PER_HOST_CONCURRENCY,
+        timeout=commands.COMMAND_TIMEOUT,
+        deadline=None,
+        ping=False,
+        ssh_port=reachability.SSH_PORT,
+        connect_timeout=reachability.TIMEOUT,
+        status_path=commands.STATUS_PATH,
+        status_max_age=commands.STATUS_MAX_AGE,
+        starts=None,
+        fingerprints=None,
+        ) -> AsyncIterator[Result]:
+    """
+    Scan `machines` and yield a Result for each one as soon as it's done.
+
+    With `repo_url`, the GitLab commits API of the configuration repository,
+    every result is compared against its newest commit, `token` is a
+    personal access token for it.
+
+    At most `concurrency` commands run at once, `per_host` of them against
+    one machine, and new ssh connections are paced by `starts`, an
+    admission.Admission. Pass the same `fingerprints` dict to successive
+    scans to only probe machines that changed in between.
+
+    Leaving the loop early, or cancelling the task running it, stops the
+    scan and kills the commands still running.
+    """
+    machines = list(machines)
+    checker = None if ping else reachability.Reachability(ssh_port, connect_timeout)
+    scanner = scanning.Scanner(concurrency, per_host, checker, timeout=timeout, status_path=status_path, status_max_age=status_max_age, starts=starts)
+    store = state.Store(machines)
+    # a dict of its own still tells the build times
+    fingerprints = {} if fingerprints is None else fingerprints
+    durations: dict[str, float] = {}
+    # finished machines, then None once the scan is over
+    done: asyncio.Queue[str | None] = asyncio.Queue()
+
+    remote_version = None
+    remote_task = None
+    if repo_url is not None:
+        remote_version = remote.RemoteVersion(repo_url, token, timeout)
+        remote_task = asyncio.create_task(fetch_remote_version_until(store, remote_version, deadline))
+    task = asyncio.create_task(scan_machines(scanner, store, machines, deadline=deadline, on_result=done.put_nowait, fingerprints=fingerprints, durations=durations))
+    task.add_done_callback(lambda _: done.put_nowait(None))
+    try:
+        while (machine := await done.get()) is not None:
+            if remote_task is not None:
+                # usually in long before the first machine
+                await remote_task
+            yield result(store, machine, fingerprints, durations)
+        # raises whatever ended the scan early
+        await task
+    finally:
+        for pending in [task, remote_task]:
+            if pending is not None:
+                pending.cancel()
+        await asyncio.gather(*[pending for pending in [task, remote_task] if pending is not None], return_exceptions=True)
+        if remote_version is not None:
+            remote_version.close()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import tempfile
+import time
+
+# seconds after which cached results are considered outdated
+CACHE_TTL = 300
+
+
+def cache_path():
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "fleet", "specs.json")
+
+
+def empty():
+    return {"machines": {}, "remote_versions": {}}
+
+
+def load(path=None):
+    """
+    Read the cache file, a missing or broken cache is an empty one.
+
+    {
+      "machines": {"<machine>": {"time": <epoch>, "specs": {<SPECS>},
+                                 "fingerprint": "<fingerprint>", "build_time": <epoch>}},
+      "remote_versions": {"<url>": {"time": <epoch>, "version": "<short_id>",
+                                    "etag": "<ETag>", "last_modified": "<Last-Modified>"}}
+    }
+    """
+    try:
+        with open(path or cache_path()) as cache_file:
+            data = json.load(cache_file)
+    except (OSError, ValueError):
+        return empty()
+    if not isinstance(data, dict):
+        return empty()
+    return {**empty(), **data}
+
+
+def save(data, path=None):
+    path = path or cache_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write to a temporary file first, concurrent runs never see half a cache
+    descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".specs-")
+    try:
+        with os.fdopen(descriptor, "w") as cache_file:
+            json.dump(data, cache_file)
+        os.replace(temporary_path, path)
+    except OSError:
+        os.unlink(temporary_path)
+        raise
+
+
+def is_fresh(entry, ttl=CACHE_TTL, now=None):
+    now = time.time() if now is None else now
+    return now - entry["time"] < ttl
+
+
+def is_complete(specs):
+    """
+    Whether every query of a scan answered, only then are specs worth
+    caching. nixos_version_match is left out, no scan fills it in, it's
+    worked out from the remote version when shown.
+    """
+    return not any(value in ["unset", "timeout"] for field, value in specs.items() if field != "nixos_version_match")
+
+
+def machine_entry(data, machine):
+    return data["machines"].get(machine)
+
+
+def set_machine(data, machine, specs, now=None, fingerprint=None, build_time=None):
+    entry = {
+        "time": time.time() if now is None else now,
+        "specs": specs,
+        }
+    if fingerprint is not None:
+        # what the specs were probed from, see api.reuse_specs
+        entry["fingerprint"] = fingerprint
+        entry["build_time"] = build_time
+    data["machines"][machine] = entry
+
+
+def remote_version_entry(data, url):
+    return data["remote_versions"].get(url)
+
+
+def set_remote_version(data, url, version, etag=None, last_modified=None, now=None):
+    data["remote_versions"][url] = {
+        "time": time.time() if now is None else now,
+        "version": version,
+        "etag": etag,
+        "last_modified": last_modified,
+        }
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
+import colorama
 from colorama import Fore, Style
+import functools
 import time
 import random
 
@@ -54,6 +56,11 @@ COLORS = {
         "bright": Fore.LIGHTCYAN_EX + Style.BRIGHT,
         "normal": Fore.CYAN + Style.NORMAL,
         },
+    "grey": {
+        "dim": Fore.LIGHTBLACK_EX + Style.DIM,
+        "bright": Fore.LIGHTBLACK_EX + Style.BRIGHT,
+        "normal": Fore.LIGHTBLACK_EX + Style.NORMAL,
+        },
     "standard": {
         "dim": Style.DIM,
         "bright": Style.BRIGHT,
@@ -66,39 +73,84 @@ COLORS = {
         },
 }
 
-def bump_mask(mask, amount, direction):
-
-    mask = [num + 1 if 0 < num < FLASH_STOP else num for num in mask]
+def init():
+    # ANSI escapes for consoles that don't understand them natively, a no-op elsewhere
+    colorama.just_fix_windows_console()
 
-    if amount == 0:
-        return mask
-    elif amount > len(mask):
-        return [1 if val == 0 else val for val in mask]
+# table for bytes.translate, advances every flashing character by one step
+FLASH_TABLE = bytes(value + 1 if 0 < value < FLASH_STOP else value for value in range(256))
 
-    if direction == "random":
-        while amount > 0:
-            zeros_at = [index for index, value in enumerate(mask) if value == 0]
-            if zeros_at:
-                mask[random.choice(zeros_at)] = 1
-            amount -= 1
-        return mask
 
-    if direction == "left":
-        mask = mask[::-1]
+class Mask:
+    """
+    Reveal state of a text, one byte per character: 0 is hidden (scrambled),
+    1 up to FLASH_STOP - 1 is freshly revealed (highlighted) and FLASH_STOP
+    is revealed.
 
-    try:
-        first_non_zero_at = min([index for index, value in enumerate(mask) if value != 0])
-        if amount < first_non_zero_at:
-            mask[first_non_zero_at-amount:first_non_zero_at] = [1] * amount
+    Counts of hidden and revealed characters are kept up to date, so
+    `settled` is a constant time check.
+    """
+    __slots__ = ("values", "hidden", "revealed")
+
+    def __init__(self, length):
+        self.values = bytearray(length)
+        self.hidden = length
+        self.revealed = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __repr__(self):
+        return f"Mask({list(self.values)})"
+
+    @property
+    def settled(self):
+        return self.revealed == len(self.values)
+
+    def reveal(self, index):
+        if self.values[index] == 0:
+            self.values[index] = 1
+            self.hidden -= 1
+
+    def bump(self, amount, direction):
+        values = self.values
+        length = len(values)
+        if self.revealed == length:
+            return
+
+        if self.hidden + self.revealed < length:  # something is flashing
+            values[:] = values.translate(FLASH_TABLE)
+            self.revealed = values.count(FLASH_STOP)
+
+        if amount == 0 or self.hidden == 0:
+            return
+
+        if amount > length:
+            for index in range(length):
+                self.reveal(index)
+        elif direction == "random":
+            for _ in range(amount):
+                zeros_at = [index for index, value in enumerate(values) if value == 0]
+                if zeros_at:
+                    self.reveal(random.choice(zeros_at))
+        elif direction == "left":
+            # continue right after the last revealed character
+            start = len(values.rstrip(b"\0"))
+            for index in range(start, min(start + amount, length)):
+                self.reveal(index)
         else:
-            mask[:first_non_zero_at] = [1] * first_non_zero_at
-    except ValueError:
-        mask = [0] * (len(mask) - amount) + [1] * amount
+            # continue right before the first revealed character
+            end = length - len(values.lstrip(b"\0"))
+            for index in range(max(end - amount, 0), end):
+                self.reveal(index)
 
-    if direction == "left":
-        return mask[::-1]
-    else:
-        return mask
+
+def bump_mask(mask, amount, direction):
+    mask.bump(amount, direction)
+    return mask
 
 def random_char():
     return chr(random.randint(33, 126))
@@ -106,21 +158,39 @@ def random_char():
 def color_text(color, text):
     return color + text + Style.RESET_ALL
 
+# every printable character already wrapped in the dim color of each palette
+SCRAMBLE_CELLS = {
+    color: tuple(color_text(palette["dim"], chr(code)) for code in range(33, 127))
+    for color, palette in COLORS.items()
+}
+
+@functools.lru_cache(maxsize=4096)
+def final_string(message, text_color):
+    normal = COLORS[text_color]["normal"]
+    return "".join([normal + char + Style.RESET_ALL for char in message])
+
 def get_string(message, mask, text_color, highlight_color, scramble_color):
     """
-    mask=[0, 0, 1, 0, 1, ...]"
+    mask=Mask(len(message)), a settled mask returns a cached string
     """
+    if mask.settled:
+        return final_string(message, text_color)
+
+    values = mask.values
+    normal = COLORS[text_color]["normal"]
+    bright = COLORS[highlight_color]["bright"]
+    scramble = SCRAMBLE_CELLS[scramble_color]
     string = ''.join([
-        color_text(COLORS[scramble_color]["dim"], random_char()) if mask[i]==0 else
-        color_text(COLORS[highlight_color]["bright"], message[i]) if 0<mask[i]<FLASH_STOP else
-        color_text(COLORS[text_color]["normal"], message[i])
+        random.choice(scramble) if values[i]==0 else
+        bright + message[i] + Style.RESET_ALL if values[i]<FLASH_STOP else
+        normal + message[i] + Style.RESET_ALL
         for i in range(len(message))
         ])
     return string
 
 def coalesce_random(color):
     print()
-    mask = [0]*len(MESSAGE)
+    mask = Mask(len(MESSAGE))
     for i in range(len(MESSAGE) + FLASH_STOP):
         print("\033[1A" + get_string(MESSAGE, mask, color, color, "none"))
         mask = bump_mask(mask, 2, "random")
@@ -128,7 +198,7 @@ def coalesce_random(color):
 
 def coalesce_left(color):
     print()
-    mask = [0]*len(MESSAGE)
+    mask = Mask(len(MESSAGE))
     for i in range(len(MESSAGE) + FLASH_STOP):
         print("\033[1A" + get_string(MESSAGE, mask, color, color, "none"))
         mask = bump_mask(mask, 2, "left")
@@ -136,7 +206,7 @@ def coalesce_left(color):
 
 def coalesce_right(color):
     print()
-    mask = [0]*len(MESSAGE)
+    mask = Mask(len(MESSAGE))
     for i in range(len(MESSAGE) + FLASH_STOP):
         print("\033[1A" + get_string(MESSAGE, mask, color, color, "none"))
         mask = bump_mask(mask, 2, "right")
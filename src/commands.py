@@ -1,7 +1,12 @@
 #!/usr/bin/env python3
 
+import functools
 import json
-import subprocess
+import shlex
+import socket
+import time
+
+import pool
 
 from datetime import datetime, timedelta
 
@@ -13,30 +18,36 @@ machines = [
     "pintsize",
     ]
 
-this_machine = subprocess.run(["hostname"], capture_output=True, text=True).stdout.strip()
+# seconds a single command may take before it is killed
+COMMAND_TIMEOUT = 10
 
-def run_on(machine, command):
-    if machine == this_machine:
-        commands = command
-    else:
-        commands = ["ssh", machine, *command]
+@functools.cache
+def this_machine():
+    # same as `hostname`, without starting a process
+    return socket.gethostname()
+
+def remote_command(machine, command):
+    if machine == this_machine():
+        return command
+    # ssh hands the remote shell a single string, so quote the arguments
+    return ["ssh", *pool.ssh_options(machine), machine, shlex.join(command)]
 
-    return subprocess.run(commands, capture_output=True, text=True)
 
+def ping_command(machine):
+    return ["ping", "-c", "1", "-W", "2", machine]
 
-def is_online(machine):
-    command = ["ping", "-c", "1", "-W", "2", machine]
-    ping_output = run_on(this_machine, command)
+
+def parse_is_online(ping_output):
     if ping_output.returncode == 0:
         return True
     else:
         return False
 
 
-def automation_status(machine):
-    command = ["systemctl", "status", "nixos-upgrade.service"]
-    output = run_on(machine, command)
+AUTOMATION_STATUS_COMMAND = ["systemctl", "status", "nixos-upgrade.service"]
+
 
+def parse_automation_status(output):
     if output.stderr or not "Loaded: loaded" in output.stdout:
         return "not automated"
 
@@ -48,25 +59,20 @@ def automation_status(machine):
         return "unknown"
 
 
-def nixos_version(machine):
-    command = ["nixos-version", "--json"]
-    version_json = run_on(machine, command).stdout.strip()
+NIXOS_VERSION_COMMAND = ["nixos-version", "--json"]
+
+
+def parse_nixos_version(output):
+    version_json = output.stdout.strip()
     version_dict = json.loads(version_json)
     return version_dict["configurationRevision"][:8]
 
-def remote_nixos_version(url, pat=None):
-    if pat:
-        command = ["curl", "-s", "--header", f"PRIVATE-TOKEN: {pat}", url]
-    else:
-        command = ["curl", "-s", url]
-    repo_info = run_on(this_machine, command).stdout.strip()
-    repo_info_json = json.loads(repo_info)
-    return repo_info_json[0]["short_id"]
+
+GENERATION_COMMAND = ["ls", "-l", "/nix/var/nix/profiles/system"]
 
 
-def generation(machine):
-    command = ["ls", "-l", "/nix/var/nix/profiles/system"]
-    system_folder = run_on(machine, command).stdout.strip()
+def parse_generation(output):
+    system_folder = output.stdout.strip()
     system_string = system_folder.split()[-1]
     if "No such file or directory" in system_string:
         return "unknown"
@@ -74,11 +80,7 @@ def generation(machine):
     return generation_number
 
 
-def last_build(machine):
-    command = ["ls", "-l", "--time-style=long-iso", "/nix/var/nix/profiles/system"]
-    system_folder = run_on(machine, command).stdout.strip()
-    build_date_string = " ".join(system_folder.split()[-5:-3])
-    build_date = datetime.strptime(build_date_string, "%Y-%m-%d %H:%M")
+def build_age(build_date):
     difference = datetime.today() - build_date
     difference_days = str(difference.days)
     difference_hours = str(difference.seconds//3600)
@@ -86,3 +88,153 @@ def last_build(machine):
         return difference_hours + "h"
     else:
         return difference_days + "d " + difference_hours + "h"
+
+
+LAST_BUILD_COMMAND = ["ls", "-l", "--time-style=long-iso", "/nix/var/nix/profiles/system"]
+
+
+def parse_last_build(output):
+    system_folder = output.stdout.strip()
+    build_date_string = " ".join(system_folder.split()[-5:-3])
+    build_date = datetime.strptime(build_date_string, "%Y-%m-%d %H:%M")
+    return build_age(build_date)
+
+
+# Changes whenever anything the probes report may have changed: the system
+# profile points to a new generation, another system was switched to, or
+# nixos-upgrade.service changed its state (a build started, finished or
+# failed). Reading it costs a fraction of a full probe.
+FINGERPRINT_SCRIPT = """\
+fingerprint="$(readlink /nix/var/nix/profiles/system 2>/dev/null) $(readlink /run/current-system 2>/dev/null) $(systemctl show --property=StateChangeTimestampMonotonic --value nixos-upgrade.service 2>/dev/null)"
+"""
+
+FINGERPRINT_COMMAND = ["sh", "-c", FINGERPRINT_SCRIPT + 'printf \'%s\\n\' "$fingerprint"\n']
+
+
+def parse_fingerprint(output):
+    fingerprint = output.stdout.strip()
+    if output.returncode != 0 or not fingerprint:
+        return None
+    return fingerprint
+
+
+# Collects everything `automation_status`, `nixos_version`, `generation` and
+# `last_build` need in a single remote execution, together with the
+# fingerprint of that state. Only plain POSIX sh and coreutils are used, the
+# values are simple enough to be embedded in JSON without escaping.
+PROBE_SCRIPT = FINGERPRINT_SCRIPT + """\
+load_state=$(systemctl show --property=LoadState --value nixos-upgrade.service 2>/dev/null)
+active_state=$(systemctl show --property=ActiveState --value nixos-upgrade.service 2>/dev/null)
+version=$(nixos-version --json 2>/dev/null)
+profile_link=$(readlink /nix/var/nix/profiles/system 2>/dev/null)
+profile_mtime=$(stat --format=%Y /nix/var/nix/profiles/system 2>/dev/null)
+printf '{"load_state": "%s", "active_state": "%s", "nixos_version": %s, "profile_link": "%s", "profile_mtime": %s, "fingerprint": "%s"}\\n' \\
+    "$load_state" "$active_state" "${version:-null}" "$profile_link" "${profile_mtime:-null}" "$fingerprint"
+"""
+
+PROBE_COMMAND = ["sh", "-c", PROBE_SCRIPT]
+
+
+def probe_specs(payload):
+    specs = {}
+
+    if payload["load_state"] != "loaded":
+        specs["automation_status"] = "not automated"
+    elif payload["active_state"] == "inactive":
+        specs["automation_status"] = "automated"
+    elif payload["active_state"] == "failed":
+        specs["automation_status"] = "build failed"
+    else:
+        specs["automation_status"] = "unknown"
+
+    try:
+        specs["nixos_version"] = payload["nixos_version"]["configurationRevision"][:8]
+    except (KeyError, TypeError):
+        specs["nixos_version"] = "unknown"
+
+    generation_number = "".join(list(filter(str.isdigit, payload["profile_link"])))
+    specs["generation"] = generation_number or "unknown"
+
+    if payload["profile_mtime"] is None:
+        specs["last_build"] = "unknown"
+    else:
+        specs["last_build"] = build_age(datetime.fromtimestamp(payload["profile_mtime"]))
+
+    return specs
+
+
+# written by `fleet --agent` on the machines themselves, see agent.py
+STATUS_PATH = "/var/lib/fleet/status.json"
+# seconds after which a status document is no longer trusted
+STATUS_MAX_AGE = 3600
+
+
+def status_probe_command(path=STATUS_PATH):
+    # the status document if the machine has one, the full probe otherwise
+    return ["sh", "-c", f"cat {shlex.quote(path)} 2>/dev/null || {{\n{PROBE_SCRIPT}}}"]
+
+
+def status_document(payload, now):
+    """
+    The status document for a probe payload, see PROBE_SCRIPT.
+    """
+    specs = probe_specs(payload)
+    try:
+        revision = payload["nixos_version"]["configurationRevision"]
+    except (KeyError, TypeError):
+        revision = None
+    return {
+        "time": now,
+        "automation_status": specs["automation_status"],
+        "configuration_revision": revision,
+        "generation": specs["generation"],
+        "build_time": payload["profile_mtime"],
+        "fingerprint": payload.get("fingerprint"),
+        }
+
+
+def status_specs(document):
+    revision = document.get("configuration_revision")
+    build_time = document.get("build_time")
+    return {
+        "automation_status": document.get("automation_status", "unknown"),
+        "nixos_version": revision[:8] if revision else "unknown",
+        "generation": document.get("generation") or "unknown",
+        "last_build": build_age(datetime.fromtimestamp(build_time)) if build_time is not None else "unknown",
+        }
+
+
+def payload_specs(payload):
+    """
+    Specs from a probe payload or a status document.
+    """
+    if "load_state" in payload:
+        return probe_specs(payload)
+    return status_specs(payload)
+
+
+def payload_change(payload):
+    """
+    (fingerprint, build time) of a probe payload or status document, what an
+    incremental scan needs to tell whether specs are still current and to
+    work out `last_build` without asking again.
+    """
+    fingerprint = (payload.get("fingerprint") or "").strip() or None
+    if "load_state" in payload:
+        return fingerprint, payload["profile_mtime"]
+    return fingerprint, payload.get("build_time")
+
+
+def parse_status_payload(output, max_age=STATUS_MAX_AGE, now=None):
+    """
+    The probe payload or status document in the output of
+    `status_probe_command`, None if the status document is older than
+    `max_age` seconds.
+    """
+    payload = json.loads(output.stdout.strip())
+    if "load_state" in payload:
+        return payload
+    now = time.time() if now is None else now
+    if not isinstance(payload.get("time"), (int, float)) or now - payload["time"] > max_age:
+        return None
+    return payload
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+"""
+Prometheus exporter, `fleet --exporter [HOST:]PORT`.
+
+Scans the fleet in the background every `interval` seconds and answers
+GET /metrics from the latest results in memory, so a scrape never starts an
+ssh connection no matter how often it comes in. Successive scans only probe
+machines whose fingerprint changed, see api.reuse_specs.
+"""
+
+import sys
+import threading
+import time
+
+import api
+import lazy
+
+asyncio = lazy.load("asyncio")
+# fleet reads PORT and INTERVAL while parsing its arguments, serve is much later
+http_server = lazy.load("http.server")
+
+PORT = 9469
+# seconds from the start of one scan to the start of the next
+INTERVAL = 300
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# automation_status values, each one series of fleet_machine_automation_status
+AUTOMATION_STATUSES = ["automated", "build failed", "not automated", "unknown", "timeout", "none"]
+
+# per machine metrics rendered by Exporter.machine_samples, in output order
+MACHINE_METRICS = [
+    ("fleet_machine_online", "Whether the machine answered, 1 online, 0 offline or timed out."),
+    ("fleet_machine_automation_status", "Status of nixos-upgrade.service, 1 for the current one."),
+    ("fleet_machine_version_match", "Whether the machine runs the newest commit of the configuration repository."),
+    ("fleet_machine_generation", "Generation of the system profile."),
+    ("fleet_machine_scan_duration_seconds", "Seconds the last scan of the machine took."),
+    ]
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def sample(name, value, **labels):
+    if not labels:
+        return f"{name} {value}"
+    pairs = ",".join(f'{key}="{escape(text)}"' for key, text in labels.items())
+    return f"{name}{{{pairs}}} {value}"
+
+
+class Exporter:
+    """
+    The latest scan result of every machine, and the scans that keep them
+    up to date.
+
+    Results are replaced one machine at a time as they come in, a scrape
+    during a scan sees the new results of the machines done so far and the
+    previous ones of the rest.
+    """
+
+    def __init__(self, machines, repo_url, token=None, interval=INTERVAL, incremental=True, **options):
+        self.machines = list(machines)
+        self.repo_url = repo_url
+        self.token = token
+        self.interval = interval
+        # passed on to api.scan
+        self.options = options
+        self.fingerprints: dict[str, api.Fingerprint] | None = {} if incremental else None
+        self.results: dict[str, api.Result] = {}
+        # machine -> (result, samples), see machine_samples
+        self.rendered: dict[str, tuple[api.Result, dict[str, list[str]]]] = {}
+        self.scans = 0
+        # start (epoch seconds) and duration of the last complete scan
+        self.last_scan: tuple[float, float] | None = None
+
+    async def scan(self):
+        started = time.time()
+        start = time.perf_counter()
+        async for result in api.scan(self.machines, self.repo_url, self.token, fingerprints=self.fingerprints, **self.options):
+            self.results[result.machine] = result
+        self.scans += 1
+        self.last_scan = (started, time.perf_counter() - start)
+
+    async def run(self):
+        while True:
+            start = time.monotonic()
+            try:
+                await self.scan()
+            except Exception as e:
+                # keep serving the last results, the next scan may go through
+                print(f"fleet: scan failed: {e}", file=sys.stderr)
+            await asyncio.sleep(max(0, self.interval - (time.monotonic() - start)))
+
+    def machine_samples(self, result):
+        """
+        The samples of one result by metric, without its build age. Rendered
+        once per result, a scrape mostly joins strings.
+        """
+        rendered = self.rendered.get(result.machine)
+        if rendered is not None and rendered[0] is result:
+            return rendered[1]
+        machine = result.machine
+        samples = {
+            "fleet_machine_online": [sample("fleet_machine_online", 1 if result.is_online == "true" else 0, machine=machine)],
+            "fleet_machine_automation_status": [
+                sample("fleet_machine_automation_status", 1 if result.automation_status == status else 0, machine=machine, status=status)
+                for status in AUTOMATION_STATUSES
+                ],
+            "fleet_machine_version_match": [],
+            "fleet_machine_generation": [],
+            "fleet_machine_scan_duration_seconds": [],
+            }
+        if result.nixos_version_match in ["true", "false"]:
+            samples["fleet_machine_version_match"].append(sample("fleet_machine_version_match", 1 if result.nixos_version_match == "true" else 0, machine=machine, nixos_version=result.nixos_version))
+        if result.generation.isdigit():
+            samples["fleet_machine_generation"].append(sample("fleet_machine_generation", result.generation, machine=machine))
+        if result.duration is not None:
+            samples["fleet_machine_scan_duration_seconds"].append(sample("fleet_machine_scan_duration_seconds", f"{result.duration:.3f}", machine=machine))
+        self.rendered[machine] = (result, samples)
+        return samples
+
+    def metrics(self, now=None):
+        """
+        The results in the Prometheus text exposition format.
+        """
+        now = time.time() if now is None else now
+        results = [self.results[machine] for machine in self.machines if machine in self.results]
+        samples = [self.machine_samples(result) for result in results]
+        lines = []
+
+        def family(name, kind, description, family_samples):
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(family_samples)
+
+        for name, description in MACHINE_METRICS:
+            family(name, "gauge", description, [line for machine_samples in samples for line in machine_samples[name]])
+        # moves on with every scrape, not worth caching
+        family("fleet_machine_build_age_seconds", "gauge", "Seconds since the system profile was built.", [
+            sample("fleet_machine_build_age_seconds", round(now - result.build_time), machine=result.machine)
+            for result in results
+            if result.build_time is not None
+            ])
+
+        remote_versions = {result.remote_version for result in results} - set(api.PLACEHOLDERS)
+        family("fleet_remote_version_info", "gauge", "Newest commit of the configuration repository.", [
+            sample("fleet_remote_version_info", 1, version=version)
+            for version in sorted(remote_versions)
+            ])
+        family("fleet_scans_total", "counter", "Complete scans since the exporter started.", [
+            sample("fleet_scans_total", self.scans),
+            ])
+        if self.last_scan is not None:
+            family("fleet_scan_timestamp_seconds", "gauge", "Start of the last complete scan.", [
+                sample("fleet_scan_timestamp_seconds", round(self.last_scan[0], 3)),
+                ])
+            family("fleet_scan_duration_seconds", "gauge", "Seconds the last complete scan took.", [
+                sample("fleet_scan_duration_seconds", f"{self.last_scan[1]:.3f}"),
+                ])
+        return "\n".join(lines) + "\n"
+
+
+def parse_address(address):
+    """
+    (host, port) of "HOST:PORT" or "PORT", the host defaults to localhost.
+    """
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def serve(exporter, address):
+    """
+    Answer GET /metrics from `exporter` in a thread of its own, returns the
+    server.
+    """
+
+    class Handler(http_server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ["/", "/metrics"]:
+                self.send_error(404)
+                return
+            body = exporter.metrics().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *arguments):
+            pass
+
+    server = http_server.ThreadingHTTPServer(parse_address(address), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,27 +1,46 @@
 #!/usr/bin/env python3
 
+import argparse
+import atexit
+import heapq
+import json
+import sys
 import threading
 import os
+import subprocess
 import time
 
+import admission
+import agent
+import api
 import commands
+import cache
 import colors
-
+import exporter
+import lazy
+import reachability
+import relay
+import render
+import scan
+import state
+import timing
+import view
+
+from datetime import datetime, timezone
 from typing import TypedDict
 
+# not needed to parse the arguments and draw the first frame, see lazy.load
+asyncio = lazy.load("asyncio")
+history = lazy.load("history")
+remote = lazy.load("remote")
 
-try:
-    MACHINE_LIST: list[str] = os.environ['FLEET_MACHINES'].split(" ")
-    URL: str = os.environ['FLEET_REPO_URL']
-    MAX_MACHINE_LENGTH: int = max([len(machine) for machine in MACHINE_LIST + ["machine"]])
-    PAT_TOKEN: str | None
-    try:
-        # optional personal access token for your repository
-        PAT_TOKEN = os.environ['FLEET_PAT_TOKEN']
-    except KeyError:
-        PAT_TOKEN = None
-except KeyError as e:
-    raise KeyError(f"Please set the environment variable {e}, see fleet --help")
+
+# set by configure(), main() reads them from the environment
+MACHINE_LIST: list[str] = []
+URL: str = ""
+# optional personal access token for your repository
+PAT_TOKEN: str | None = None
+MAX_MACHINE_LENGTH: int = len("machine")
 
 MASK_STEP = 1
 DIRECTION = "left"
@@ -32,6 +51,7 @@ ERROR_COLOR = "red"
 SCRAMBLE_COLOR = "cyan"
 HIGHLIGHT_COLOR = "cyan"
 STANDARD_COLOR = "standard"
+STALE_COLOR = "grey"
 
 COLOR_MACHINES = False
 COLOR_VERSIONS = False
@@ -39,244 +59,467 @@ COLOR_BUILT = False
 
 DELAY = 0.05
 
-SPECS: dict[str, str] = {
-    "is_online": "unset",
-    "automation_status": "unset",
-    "nixos_version": "unset",
-    "nixos_version_match": "unset",
-    "generation": "unset",
-    "last_build": "unset",
-    }
+# seconds the whole scan may take before it gives up on late machines
+DEADLINE = 30
+
+# seconds between polls of a machine in --watch mode
+WATCH_HEALTHY_INTERVAL = 300
+WATCH_PROBLEM_INTERVAL = 30
+# offline machines start here and back off exponentially up to the maximum
+WATCH_OFFLINE_INTERVAL = 15
+WATCH_OFFLINE_MAX_INTERVAL = 900
+WATCH_REMOTE_INTERVAL = 120
+WATCH_TICK = 1
+
+# fetch all specs of a machine with one remote call instead of one per query
+BATCH_PROBE = True
 
 class TextSpecs(TypedDict):
-    machine_mask: list[int]
-    is_online_mask: list[int]
-    automation_status_mask: list[int]
-    nixos_version_mask: list[int]
-    nixos_version_match_mask: list[int]
-    generation_mask: list[int]
-    last_build_mask: list[int]
-    last_build_warning_mask: list[int]
-TEXT_SPECS: TextSpecs = {
-    "machine_mask": [0] * MAX_MACHINE_LENGTH,
-    "is_online_mask": [0],
-    "automation_status_mask": [0],
-    "nixos_version_mask": [0] * 8,
-    "nixos_version_match_mask": [0],
-    "generation_mask": [0] * 5,
-    "last_build_mask": [0] * 8,
-    "last_build_warning_mask": [0],
+    machine_mask: colors.Mask
+    is_online_mask: colors.Mask
+    automation_status_mask: colors.Mask
+    nixos_version_mask: colors.Mask
+    nixos_version_match_mask: colors.Mask
+    generation_mask: colors.Mask
+    last_build_mask: colors.Mask
+    last_build_warning_mask: colors.Mask
+# mask lengths, see new_text_specs, the machine mask is MAX_MACHINE_LENGTH long
+TEXT_SPECS: dict[str, int] = {
+    "is_online_mask": 1,
+    "automation_status_mask": 1,
+    "nixos_version_mask": 8,
+    "nixos_version_match_mask": 1,
+    "generation_mask": 5,
+    "last_build_mask": 8,
+    "last_build_warning_mask": 1,
     }
 
+def new_text_specs() -> TextSpecs:
+    # masks are updated in place, every machine needs its own
+    return {"machine_mask": colors.Mask(MAX_MACHINE_LENGTH), **{key: colors.Mask(length) for key, length in TEXT_SPECS.items()}}
+
 class VersionTextSpecs(TypedDict):
-    version_mask: list[int]
+    version_mask: colors.Mask
 
 VERSION_TEXT_SPECS: VersionTextSpecs = {
-    "version_mask": [0, 0, 0, 0, 0, 0, 0, 0],
+    "version_mask": colors.Mask(8),
     }
 
-MACHINE_SPECS: dict[str, dict[str, str]] = {}
-for machine in MACHINE_LIST:
-    MACHINE_SPECS[machine] = SPECS.copy()
+# written by the scan, read by the dashboard, see state.Store
+STATE = state.Store()
 
+# animation state, only touched by the dashboard thread and reset_masks
 MACHINE_TEXT_SPECS: dict[str, TextSpecs] = {}
-for machine in MACHINE_LIST:
-    MACHINE_TEXT_SPECS[machine] = TEXT_SPECS.copy()
 
-REMOTE_VERSION = "unset"
+# the part of the table on screen, see view.View
+VIEW = view.View()
+# machines in display order for a (STATE.version, sort, filter) key
+ORDER: tuple[tuple, list[str]] = ((), [])
+# machines drawn in the last frame
+VISIBLE: list[str] = []
+
+# rendered rows of settled machines: machine -> (key, text specs, row)
+ROWS: dict[str, tuple[tuple, TextSpecs, str]] = {}
+
+# what the last full probe of a machine found, a scan only probes machines
+# again whose fingerprint differs, see api.reuse_specs
+FINGERPRINTS: dict[str, api.Fingerprint] = {}
+INCREMENTAL = True
+
+# last known results from the cache, shown until live results replace them
+CACHED_SPECS: dict[str, dict[str, str]] = {}
+CACHED_REMOTE_VERSION = "unset"
 
 DONE = False
 
-def get_remote_version(url, pat):
-    global REMOTE_VERSION
+# machines scanned by a relay instead of this instance, see relay.Relays
+RELAYED: set[str] = set()
+
+# scan results are appended here unless --no-history, see history.History
+HISTORY = None
+
+# where print_record writes to, None is stdout
+OUTPUT = None
+PRINT_LOCK = threading.Lock()
+# set once the first frame is on screen
+FIRST_FRAME = threading.Event()
+
+def configure(machines, url, pat_token=None):
+    """
+    Set up the machines to show and the repository to compare against.
+    """
+    global MACHINE_LIST, URL, PAT_TOKEN, MAX_MACHINE_LENGTH, STATE, MACHINE_TEXT_SPECS
+    MACHINE_LIST = list(machines)
+    URL = url
+    PAT_TOKEN = pat_token
+    MAX_MACHINE_LENGTH = max([len(machine) for machine in MACHINE_LIST + ["machine"]])
+    STATE = state.Store(MACHINE_LIST)
+    MACHINE_TEXT_SPECS = {machine: new_text_specs() for machine in MACHINE_LIST}
+    ROWS.clear()
+
+def configure_from_environment(environ=os.environ, relayed=()):
+    """
+    Read FLEET_MACHINES, FLEET_REPO_URL and FLEET_PAT_TOKEN, raises KeyError
+    naming the first missing variable.
+
+    Machines announced by relays are added to FLEET_MACHINES, which may then
+    be left unset.
+    """
+    global RELAYED
+    if relayed:
+        machines = environ.get("FLEET_MACHINES", "").split()
+    else:
+        machines = environ["FLEET_MACHINES"].split(" ")
+    machines += [machine for machine in relayed if machine not in machines]
+    configure(machines, environ["FLEET_REPO_URL"], environ.get("FLEET_PAT_TOKEN"))
+    RELAYED = set(relayed)
+
+def current_spec(machine, query, specs=None):
+    """
+    Returns the value to show for `query` and whether it is a stale cached one.
+
+    `specs` is a snapshot of the machine, read from the store if missing.
+    """
+    value = (specs if specs is not None else STATE.specs(machine))[query]
+    if value == "unset" and machine in CACHED_SPECS:
+        return CACHED_SPECS[machine].get(query, "unset"), True
+    return value, False
+
+def current_remote_version():
+    # fall back to the cached version while the API is slow or unreachable
+    remote_version = STATE.remote_version
+    if remote_version in ["unset", "unknown", "timeout"] and CACHED_REMOTE_VERSION != "unset":
+        return CACHED_REMOTE_VERSION, True
+    return remote_version, False
+
+def cell_color(stale, color):
+    return STALE_COLOR if stale else color
+
+def load_cache(data, ttl, skip_fresh):
+    """
+    Fill the dashboard from cached results, returns the machines that still
+    need a live scan.
+    """
+    global CACHED_REMOTE_VERSION
+    to_scan = []
+    for machine in MACHINE_LIST:
+        entry = cache.machine_entry(data, machine)
+        if entry is None:
+            to_scan.append(machine)
+        elif skip_fresh and cache.is_fresh(entry, ttl):
+            STATE.update(machine, entry["specs"])
+        else:
+            CACHED_SPECS[machine] = entry["specs"]
+            to_scan.append(machine)
+        if entry is not None and entry.get("fingerprint"):
+            FINGERPRINTS[machine] = {
+                "fingerprint": entry["fingerprint"],
+                "build_time": entry.get("build_time"),
+                "specs": {query: entry["specs"].get(query, "unknown") for query in api.PROBED},
+                }
+
+    entry = cache.remote_version_entry(data, URL)
+    if entry is not None:
+        CACHED_REMOTE_VERSION = entry["version"]
+    return to_scan
+
+def save_cache(data, machines, remote_version):
+    for machine in machines:
+        specs = STATE.specs(machine)
+        if cache.is_complete(specs):
+            known = FINGERPRINTS.get(machine)
+            if known is None:
+                cache.set_machine(data, machine, specs)
+            else:
+                cache.set_machine(data, machine, specs, fingerprint=known["fingerprint"], build_time=known["build_time"])
+    if STATE.remote_version not in ["unset", "unknown", "timeout"]:
+        cache.set_remote_version(data, URL, STATE.remote_version, remote_version.etag, remote_version.last_modified)
     try:
-        REMOTE_VERSION = commands.remote_nixos_version(url, pat)
-    except Exception as e:
-        REMOTE_VERSION = "unknown"
+        cache.save(data)
+    except OSError:
+        pass  # the cache is a convenience, the scan results are already on screen
 
-def run_task(query, machine):
-    global MACHINE_SPECS
-    try:
-        MACHINE_SPECS[machine][query.__name__] = query(machine)
-    except:
-        MACHINE_SPECS[machine][query.__name__] = "unknown"
-
-def get_machine_specs(machine):
-    global MACHINE_SPECS
-    is_online = commands.is_online(machine)
-    if not is_online:
-        MACHINE_SPECS[machine]["is_online"] = "false"
-        MACHINE_SPECS[machine]["automation_status"] = "none"
-        MACHINE_SPECS[machine]["nixos_version"] = "none"
-        MACHINE_SPECS[machine]["nixos_version_match"] = "none"
-        MACHINE_SPECS[machine]["generation"] = "none"
-        MACHINE_SPECS[machine]["last_build"] = "none"
+def record_history(machines):
+    if HISTORY is None:
         return
+    try:
+        HISTORY.record([(machine, STATE.specs(machine)) for machine in machines], STATE.remote_version)
+    except (OSError, history.sqlite3.Error):
+        pass  # like the cache, the history must not get in the way of the scan
+
+def fingerprints():
+    return FINGERPRINTS if INCREMENTAL else None
+
+def make_scanner(arguments):
+    starts = admission.Admission(arguments.starts_per_host, arguments.starts_per_jump_host, retries=arguments.retries)
+    if arguments.ping:
+        return scan.Scanner(arguments.concurrency, arguments.per_host, timeout=arguments.timeout, status_path=arguments.status_file, status_max_age=arguments.status_max_age, starts=starts)
+    checker = reachability.Reachability(arguments.ssh_port, arguments.connect_timeout)
+    return scan.Scanner(arguments.concurrency, arguments.per_host, checker, timeout=arguments.timeout, status_path=arguments.status_file, status_max_age=arguments.status_max_age, starts=starts)
+
+async def scan_fleet(arguments, machines, remote_version, on_result=None):
+    """
+    Scan `machines` once, `on_result(machine)` is called as soon as the specs
+    of a machine are complete.
+    """
+    await api.scan_machines(make_scanner(arguments), STATE, machines, remote_version, arguments.deadline, on_result, fingerprints(), BATCH_PROBE)
+
+def has_problem(machine):
+    specs = STATE.specs(machine)
+    if specs["automation_status"] in ["build failed", "unknown", "timeout"]:
+        return True
+    if specs["generation"] in ["unknown", "timeout"] or specs["last_build"] in ["unknown", "timeout"]:
+        return True
+    if specs["nixos_version"] in ["unknown", "timeout"]:
+        return True
+    remote_version, _ = current_remote_version()
+    return remote_version not in ["unset", "unknown", "timeout"] and specs["nixos_version"] != remote_version
+
+def poll_interval(machine, offline_polls):
+    if STATE.get(machine, "is_online") != "true":
+        return min(WATCH_OFFLINE_INTERVAL * 2 ** offline_polls, WATCH_OFFLINE_MAX_INTERVAL)
+    if has_problem(machine):
+        return WATCH_PROBLEM_INTERVAL
+    return WATCH_HEALTHY_INTERVAL
+
+def reset_masks(machine):
+    global MACHINE_TEXT_SPECS
+    MACHINE_TEXT_SPECS[machine] = new_text_specs()
+
+async def rescan_machine(scanner, machine, deadline, on_result=None):
+    before = STATE.snapshot(machine)[0]
+    if scanner.reachability is not None:
+        scanner.reachability.forget(machine)
+    # a store of its own, so a deadline can tell which specs this poll
+    # refreshed, STATE still holds the previous poll's
+    polled = state.Store([machine])
+    try:
+        async with asyncio.timeout(deadline):
+            await api.machine_specs(scanner, polled, machine, fingerprints(), BATCH_PROBE)
+    except TimeoutError:
+        api.mark_timeouts(polled, machine)
+    STATE.update(machine, polled.specs(machine))
+    if STATE.snapshot(machine)[0] != before:
+        # replay the reveal animation for this row only
+        reset_masks(machine)
+    record_history([machine])
+    if on_result is not None:
+        on_result(machine)
+
+async def watch_remote_version(remote_version, cache_data):
+    while True:
+        await api.fetch_remote_version(STATE, remote_version)
+        if cache_data is not None:
+            save_cache(cache_data, MACHINE_LIST, remote_version)
+        await asyncio.sleep(WATCH_REMOTE_INTERVAL)
+
+async def watch_fleet(arguments, machines, remote_version, cache_data, on_result=None):
+    """
+    Keep polling every machine on its own schedule: healthy ones rarely,
+    ones with problems often, offline ones with exponential backoff.
+    """
+    scanner = make_scanner(arguments)
+    now = time.monotonic()
+    local_machines = [machine for machine in MACHINE_LIST if machine not in RELAYED]
+    schedule = [(now if machine in machines else now + WATCH_HEALTHY_INTERVAL, machine) for machine in local_machines]
+    heapq.heapify(schedule)
+    offline_polls: dict[str, int] = {machine: 0 for machine in local_machines}
+    due: asyncio.Queue[str] = asyncio.Queue()
+
+    async def worker():
+        while True:
+            machine = await due.get()
+            await rescan_machine(scanner, machine, arguments.deadline, on_result)
+            interval = poll_interval(machine, offline_polls[machine])
+            if STATE.get(machine, "is_online") == "true":
+                offline_polls[machine] = 0
+            else:
+                offline_polls[machine] += 1
+            heapq.heappush(schedule, (time.monotonic() + interval, machine))
 
-    MACHINE_SPECS[machine]["is_online"] = "true"
-    queries = [
-        commands.automation_status,
-        commands.nixos_version,
-        commands.generation,
-        commands.last_build,
-    ]
-    tasks = []
-    for query in queries:
-        tasks.append(threading.Thread(target=run_task, args=(query, machine,), daemon=True))
-    for task in tasks:
-        task.start()
-    for task in tasks:
-        task.join()
+    tasks = [asyncio.create_task(worker()) for _ in range(min(scanner.concurrency, len(local_machines)))]
+    tasks.append(asyncio.create_task(watch_remote_version(remote_version, cache_data)))
+    try:
+        while True:
+            now = time.monotonic()
+            while schedule and schedule[0][0] <= now:
+                due.put_nowait(heapq.heappop(schedule)[1])
+            next_due = schedule[0][0] if schedule else now + WATCH_TICK
+            await asyncio.sleep(min(max(next_due - now, 0), WATCH_TICK))
+    finally:
+        for task in tasks:
+            task.cancel()
 
 def get_remote_version_text():
-    global REMOTE_VERSION
     global VERSION_TEXT_SPECS
 
-    if REMOTE_VERSION == "unset":
-        text: str = colors.get_string("++++++++", VERSION_TEXT_SPECS["version_mask"], text_color=STANDARD_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
-    elif REMOTE_VERSION == "unknown":
-        text: str = colors.get_string("       ?", VERSION_TEXT_SPECS["version_mask"], text_color=ERROR_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+    remote_version, stale = current_remote_version()
+    if remote_version == "unset":
+        text: str = colors.get_string("++++++++", VERSION_TEXT_SPECS["version_mask"], text_color=cell_color(stale, STANDARD_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+    elif remote_version == "unknown":
+        text: str = colors.get_string("       ?", VERSION_TEXT_SPECS["version_mask"], text_color=cell_color(stale, ERROR_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+        VERSION_TEXT_SPECS["version_mask"] = colors.bump_mask(VERSION_TEXT_SPECS["version_mask"], MASK_STEP, DIRECTION)
+    elif remote_version == "timeout":
+        text: str = colors.get_string("       ~", VERSION_TEXT_SPECS["version_mask"], text_color=cell_color(stale, WARNING_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
         VERSION_TEXT_SPECS["version_mask"] = colors.bump_mask(VERSION_TEXT_SPECS["version_mask"], MASK_STEP, DIRECTION)
     else:
-        text: str = colors.get_string(REMOTE_VERSION, VERSION_TEXT_SPECS["version_mask"], text_color=STANDARD_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+        text: str = colors.get_string(remote_version, VERSION_TEXT_SPECS["version_mask"], text_color=cell_color(stale, STANDARD_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
         VERSION_TEXT_SPECS["version_mask"] = colors.bump_mask(VERSION_TEXT_SPECS["version_mask"], MASK_STEP, DIRECTION)
     return text
 
-def get_machine_text(machine):
-    global MACHINE_SPECS
-    global MACHINE_TEXT_SPECS
+def get_machine_text(machine, specs=None):
+    is_online, stale = current_spec(machine, "is_online", specs)
 
     machine_color: str
-    if MACHINE_SPECS[machine]["is_online"] == "true":
-        is_online_text: str = colors.get_string("•", MACHINE_TEXT_SPECS[machine]["is_online_mask"], text_color=OK_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+    if is_online == "true":
+        is_online_text: str = colors.get_string("•", MACHINE_TEXT_SPECS[machine]["is_online_mask"], text_color=cell_color(stale, OK_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
         MACHINE_TEXT_SPECS[machine]["is_online_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["is_online_mask"], MASK_STEP, DIRECTION)
         machine_color = OK_COLOR
-    elif MACHINE_SPECS[machine]["is_online"] == "false":
-        is_online_text: str = colors.get_string("-", MACHINE_TEXT_SPECS[machine]["is_online_mask"], text_color=ERROR_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+    elif is_online == "false":
+        is_online_text: str = colors.get_string("-", MACHINE_TEXT_SPECS[machine]["is_online_mask"], text_color=cell_color(stale, ERROR_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
         MACHINE_TEXT_SPECS[machine]["is_online_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["is_online_mask"], MASK_STEP, DIRECTION)
         machine_color = ERROR_COLOR
+    elif is_online == "timeout":
+        is_online_text: str = colors.get_string("~", MACHINE_TEXT_SPECS[machine]["is_online_mask"], text_color=cell_color(stale, WARNING_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+        MACHINE_TEXT_SPECS[machine]["is_online_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["is_online_mask"], MASK_STEP, DIRECTION)
+        machine_color = WARNING_COLOR
     else:
-        is_online_text: str = colors.get_string("+", MACHINE_TEXT_SPECS[machine]["is_online_mask"], text_color=STANDARD_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+        is_online_text: str = colors.get_string("+", MACHINE_TEXT_SPECS[machine]["is_online_mask"], text_color=cell_color(stale, STANDARD_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
         machine_color = STANDARD_COLOR
 
     if not COLOR_MACHINES:
         machine_color = STANDARD_COLOR
 
-    machine_text: str = colors.get_string(machine.rjust(MAX_MACHINE_LENGTH), MACHINE_TEXT_SPECS[machine]["machine_mask"], text_color=machine_color, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+    machine_text: str = colors.get_string(machine.rjust(MAX_MACHINE_LENGTH), MACHINE_TEXT_SPECS[machine]["machine_mask"], text_color=cell_color(stale, machine_color), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
     MACHINE_TEXT_SPECS[machine]["machine_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["machine_mask"], MASK_STEP, DIRECTION)
     return machine_text + " " + is_online_text
 
-def get_automation_text(machine):
-    global MACHINE_SPECS
-    global MACHINE_TEXT_SPECS
+def get_automation_text(machine, specs=None):
+    automation_status, stale = current_spec(machine, "automation_status", specs)
 
-    if MACHINE_SPECS[machine]["automation_status"] == "unset":
-        text: str = colors.get_string("+", MACHINE_TEXT_SPECS[machine]["automation_status_mask"], text_color=STANDARD_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+    if automation_status == "unset":
+        text: str = colors.get_string("+", MACHINE_TEXT_SPECS[machine]["automation_status_mask"], text_color=cell_color(stale, STANDARD_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
         return text
-    if MACHINE_SPECS[machine]["automation_status"] == "automated":
-        text: str = colors.get_string("•", MACHINE_TEXT_SPECS[machine]["automation_status_mask"], text_color=OK_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+    if automation_status == "automated":
+        text: str = colors.get_string("•", MACHINE_TEXT_SPECS[machine]["automation_status_mask"], text_color=cell_color(stale, OK_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
         MACHINE_TEXT_SPECS[machine]["automation_status_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["automation_status_mask"], MASK_STEP, DIRECTION)
         return text
-    if MACHINE_SPECS[machine]["automation_status"] == "build failed":
-        text: str = colors.get_string("!", MACHINE_TEXT_SPECS[machine]["automation_status_mask"], text_color=WARNING_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+    if automation_status == "build failed":
+        text: str = colors.get_string("!", MACHINE_TEXT_SPECS[machine]["automation_status_mask"], text_color=cell_color(stale, WARNING_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
         MACHINE_TEXT_SPECS[machine]["automation_status_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["automation_status_mask"], MASK_STEP, DIRECTION)
         return text
-    if MACHINE_SPECS[machine]["automation_status"] == "unknown":
-        text: str = colors.get_string("?", MACHINE_TEXT_SPECS[machine]["automation_status_mask"], text_color=WARNING_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+    if automation_status == "unknown":
+        text: str = colors.get_string("?", MACHINE_TEXT_SPECS[machine]["automation_status_mask"], text_color=cell_color(stale, WARNING_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+        MACHINE_TEXT_SPECS[machine]["automation_status_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["automation_status_mask"], MASK_STEP, DIRECTION)
+        return text
+    if automation_status == "timeout":
+        text: str = colors.get_string("~", MACHINE_TEXT_SPECS[machine]["automation_status_mask"], text_color=cell_color(stale, WARNING_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
         MACHINE_TEXT_SPECS[machine]["automation_status_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["automation_status_mask"], MASK_STEP, DIRECTION)
         return text
     else:  # "none"
-        text: str = colors.get_string(" ", MACHINE_TEXT_SPECS[machine]["automation_status_mask"], text_color=STANDARD_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+        text: str = colors.get_string(" ", MACHINE_TEXT_SPECS[machine]["automation_status_mask"], text_color=cell_color(stale, STANDARD_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
         MACHINE_TEXT_SPECS[machine]["automation_status_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["automation_status_mask"], MASK_STEP, DIRECTION)
         return text
 
-def get_version_text(machine):
-    global MACHINE_SPECS
-    global REMOTE_VERSION
+def get_version_text(machine, specs=None):
+    nixos_version, stale = current_spec(machine, "nixos_version", specs)
+    remote_version, _ = current_remote_version()
 
     version_color: str
 
 
-    if MACHINE_SPECS[machine]["nixos_version"] == "unset":
-        version_text: str = colors.get_string("++++++++", MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], text_color=STANDARD_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
-        version_match_text: str = colors.get_string("+", MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], text_color=STANDARD_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+    if nixos_version == "unset":
+        version_text: str = colors.get_string("++++++++", MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], text_color=cell_color(stale, STANDARD_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+        version_match_text: str = colors.get_string("+", MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], text_color=cell_color(stale, STANDARD_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+        return version_text + " " + version_match_text
+
+    elif nixos_version == "none":
+        version_text: str = colors.get_string("        ", MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], text_color=cell_color(stale, STANDARD_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+        version_match_text: str = colors.get_string(" ", MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], text_color=cell_color(stale, STANDARD_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+        MACHINE_TEXT_SPECS[machine]["nixos_version_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], MASK_STEP, DIRECTION)
         return version_text + " " + version_match_text
 
-    elif MACHINE_SPECS[machine]["nixos_version"] == "none":
-        version_text: str = colors.get_string("        ", MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], text_color=STANDARD_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
-        version_match_text: str = colors.get_string(" ", MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], text_color=STANDARD_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+    elif nixos_version == "unknown":
+        version_text: str = colors.get_string("        ", MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], text_color=cell_color(stale, STANDARD_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+        version_match_text: str = colors.get_string("?", MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], text_color=cell_color(stale, ERROR_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
         MACHINE_TEXT_SPECS[machine]["nixos_version_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], MASK_STEP, DIRECTION)
-        MACHINE_TEXT_SPECS[machine]["nixos_version_match_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], MASK_STEP, DIRECTION)
         return version_text + " " + version_match_text
 
-    elif MACHINE_SPECS[machine]["nixos_version"] == "unknown":
-        version_text: str = colors.get_string("        ", MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], text_color=STANDARD_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
-        version_match_text: str = colors.get_string("?", MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], text_color=ERROR_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+    elif nixos_version == "timeout":
+        version_text: str = colors.get_string("        ", MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], text_color=cell_color(stale, STANDARD_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+        version_match_text: str = colors.get_string("~", MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], text_color=cell_color(stale, WARNING_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
         MACHINE_TEXT_SPECS[machine]["nixos_version_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], MASK_STEP, DIRECTION)
-        MACHINE_TEXT_SPECS[machine]["nixos_version_match_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], MASK_STEP, DIRECTION)
         return version_text + " " + version_match_text
 
     else:  # has actual nixos_version
 
-        if REMOTE_VERSION == "unset" or REMOTE_VERSION == "unknown":
-            version_match_text: str = colors.get_string("?", MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], text_color=WARNING_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+        if remote_version in ["unset", "unknown", "timeout"]:
+            version_match_text: str = colors.get_string("?", MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], text_color=cell_color(stale, WARNING_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
             MACHINE_TEXT_SPECS[machine]["nixos_version_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], MASK_STEP, DIRECTION)
             version_color = WARNING_COLOR
-        elif MACHINE_SPECS[machine]["nixos_version"] == REMOTE_VERSION:
-            version_match_text: str = colors.get_string("•", MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], text_color=OK_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+        elif nixos_version == remote_version:
+            version_match_text: str = colors.get_string("•", MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], text_color=cell_color(stale, OK_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
             MACHINE_TEXT_SPECS[machine]["nixos_version_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], MASK_STEP, DIRECTION)
             version_color = OK_COLOR
-        else:  # MACHINE_SPECS[machine]["nixos_version"] != REMOTE_VERSION:
-            version_match_text: str = colors.get_string("!", MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], text_color=WARNING_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+        else:  # nixos_version != remote_version:
+            version_match_text: str = colors.get_string("!", MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], text_color=cell_color(stale, WARNING_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
             MACHINE_TEXT_SPECS[machine]["nixos_version_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], MASK_STEP, DIRECTION)
             version_color = WARNING_COLOR
 
         if not COLOR_VERSIONS:
             version_color = STANDARD_COLOR
-        version_text: str = colors.get_string(MACHINE_SPECS[machine]["nixos_version"], MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], text_color=version_color, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+        version_text: str = colors.get_string(nixos_version, MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], text_color=cell_color(stale, version_color), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
         MACHINE_TEXT_SPECS[machine]["nixos_version_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["nixos_version_mask"], MASK_STEP, DIRECTION)
 
     return version_text + " " + version_match_text
 
 
-def get_generation_text(machine):
-    global MACHINE_SPECS
+def get_generation_text(machine, specs=None):
+    generation, stale = current_spec(machine, "generation", specs)
 
-    if MACHINE_SPECS[machine]["generation"] == "unset":
-        text: str = colors.get_string("++++", MACHINE_TEXT_SPECS[machine]["generation_mask"], text_color=STANDARD_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
-    elif MACHINE_SPECS[machine]["generation"] == "none":
-        text: str = colors.get_string("    ", MACHINE_TEXT_SPECS[machine]["generation_mask"], text_color=STANDARD_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+    if generation == "unset":
+        text: str = colors.get_string("++++", MACHINE_TEXT_SPECS[machine]["generation_mask"], text_color=cell_color(stale, STANDARD_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+    elif generation == "none":
+        text: str = colors.get_string("    ", MACHINE_TEXT_SPECS[machine]["generation_mask"], text_color=cell_color(stale, STANDARD_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
         MACHINE_TEXT_SPECS[machine]["generation_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["generation_mask"], MASK_STEP, DIRECTION)
-    elif MACHINE_SPECS[machine]["generation"] == "unknown":
-        text: str = colors.get_string("   ?", MACHINE_TEXT_SPECS[machine]["generation_mask"], text_color=ERROR_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+    elif generation == "unknown":
+        text: str = colors.get_string("   ?", MACHINE_TEXT_SPECS[machine]["generation_mask"], text_color=cell_color(stale, ERROR_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+        MACHINE_TEXT_SPECS[machine]["generation_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["generation_mask"], MASK_STEP, DIRECTION)
+    elif generation == "timeout":
+        text: str = colors.get_string("   ~", MACHINE_TEXT_SPECS[machine]["generation_mask"], text_color=cell_color(stale, WARNING_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
         MACHINE_TEXT_SPECS[machine]["generation_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["generation_mask"], MASK_STEP, DIRECTION)
     else:
-        text: str = colors.get_string(MACHINE_SPECS[machine]["generation"].rjust(4), MACHINE_TEXT_SPECS[machine]["generation_mask"], text_color=STANDARD_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+        text: str = colors.get_string(generation.rjust(4), MACHINE_TEXT_SPECS[machine]["generation_mask"], text_color=cell_color(stale, STANDARD_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
         MACHINE_TEXT_SPECS[machine]["generation_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["generation_mask"], MASK_STEP, DIRECTION)
     return text
 
 
-def get_build_time_text(machine):
-    global MACHINE_SPECS
+def get_build_time_text(machine, specs=None):
+    last_build, stale = current_spec(machine, "last_build", specs)
 
     built_color: str
 
-    if MACHINE_SPECS[machine]["last_build"] == "unset":
-        build_text: str = colors.get_string("++++++++", MACHINE_TEXT_SPECS[machine]["last_build_mask"], text_color=STANDARD_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
-        build_warning_text: str = colors.get_string("+", MACHINE_TEXT_SPECS[machine]["last_build_warning_mask"], text_color=STANDARD_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
-    elif MACHINE_SPECS[machine]["last_build"] == "none":
-        build_text: str = colors.get_string("        ", MACHINE_TEXT_SPECS[machine]["last_build_mask"], text_color=STANDARD_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
-        build_warning_text: str = colors.get_string(" ", MACHINE_TEXT_SPECS[machine]["last_build_warning_mask"], text_color=STANDARD_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+    if last_build == "unset":
+        build_text: str = colors.get_string("++++++++", MACHINE_TEXT_SPECS[machine]["last_build_mask"], text_color=cell_color(stale, STANDARD_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+        build_warning_text: str = colors.get_string("+", MACHINE_TEXT_SPECS[machine]["last_build_warning_mask"], text_color=cell_color(stale, STANDARD_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+    elif last_build == "none":
+        build_text: str = colors.get_string("        ", MACHINE_TEXT_SPECS[machine]["last_build_mask"], text_color=cell_color(stale, STANDARD_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+        build_warning_text: str = colors.get_string(" ", MACHINE_TEXT_SPECS[machine]["last_build_warning_mask"], text_color=cell_color(stale, STANDARD_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+        MACHINE_TEXT_SPECS[machine]["last_build_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["last_build_mask"], MASK_STEP, DIRECTION)
+        MACHINE_TEXT_SPECS[machine]["last_build_warning_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["last_build_warning_mask"], MASK_STEP, DIRECTION)
+    elif last_build == "unknown":
+        build_text: str = colors.get_string("        ", MACHINE_TEXT_SPECS[machine]["last_build_mask"], text_color=cell_color(stale, STANDARD_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+        build_warning_text: str = colors.get_string("?", MACHINE_TEXT_SPECS[machine]["last_build_warning_mask"], text_color=cell_color(stale, ERROR_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
         MACHINE_TEXT_SPECS[machine]["last_build_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["last_build_mask"], MASK_STEP, DIRECTION)
         MACHINE_TEXT_SPECS[machine]["last_build_warning_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["last_build_warning_mask"], MASK_STEP, DIRECTION)
-    elif MACHINE_SPECS[machine]["last_build"] == "unknown":
-        build_text: str = colors.get_string("        ", MACHINE_TEXT_SPECS[machine]["last_build_mask"], text_color=STANDARD_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
-        build_warning_text: str = colors.get_string("?", MACHINE_TEXT_SPECS[machine]["last_build_warning_mask"], text_color=ERROR_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+    elif last_build == "timeout":
+        build_text: str = colors.get_string("        ", MACHINE_TEXT_SPECS[machine]["last_build_mask"], text_color=cell_color(stale, STANDARD_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+        build_warning_text: str = colors.get_string("~", MACHINE_TEXT_SPECS[machine]["last_build_warning_mask"], text_color=cell_color(stale, WARNING_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
         MACHINE_TEXT_SPECS[machine]["last_build_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["last_build_mask"], MASK_STEP, DIRECTION)
         MACHINE_TEXT_SPECS[machine]["last_build_warning_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["last_build_warning_mask"], MASK_STEP, DIRECTION)
     else:
         try:
-            days_since_last_build = int(MACHINE_SPECS[machine]["last_build"].split("d")[0])
+            days_since_last_build = int(last_build.split("d")[0])
             if days_since_last_build > 2:
                 build_warning = True
             else:
@@ -285,10 +528,10 @@ def get_build_time_text(machine):
             build_warning = False
 
         if build_warning:
-            build_warning_text: str = colors.get_string("!", MACHINE_TEXT_SPECS[machine]["last_build_warning_mask"], text_color=WARNING_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+            build_warning_text: str = colors.get_string("!", MACHINE_TEXT_SPECS[machine]["last_build_warning_mask"], text_color=cell_color(stale, WARNING_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
             built_color = WARNING_COLOR
         else:
-            build_warning_text: str = colors.get_string("•", MACHINE_TEXT_SPECS[machine]["last_build_warning_mask"], text_color=OK_COLOR, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+            build_warning_text: str = colors.get_string("•", MACHINE_TEXT_SPECS[machine]["last_build_warning_mask"], text_color=cell_color(stale, OK_COLOR), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
             built_color = OK_COLOR
 
         if not COLOR_BUILT:
@@ -296,64 +539,481 @@ def get_build_time_text(machine):
 
         MACHINE_TEXT_SPECS[machine]["last_build_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["last_build_mask"], MASK_STEP, DIRECTION)
         MACHINE_TEXT_SPECS[machine]["last_build_warning_mask"] = colors.bump_mask(MACHINE_TEXT_SPECS[machine]["last_build_warning_mask"], MASK_STEP, DIRECTION)
-        build_text: str = colors.get_string(MACHINE_SPECS[machine]["last_build"].rjust(8), MACHINE_TEXT_SPECS[machine]["last_build_mask"], text_color=built_color, highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
+        build_text: str = colors.get_string(last_build.rjust(8), MACHINE_TEXT_SPECS[machine]["last_build_mask"], text_color=cell_color(stale, built_color), highlight_color=HIGHLIGHT_COLOR, scramble_color=SCRAMBLE_COLOR)
 
     return build_text + " " + build_warning_text
 
-def assemble_text():
-    global MACHINE_SPECS
-    global MACHINE_TEXT_SPECS
+def row_settled(text_specs):
+    for key, mask in text_specs.items():
+        # the version match is drawn with nixos_version_mask
+        if key != "nixos_version_match_mask" and not mask.settled:
+            return False
+    return True
+
+def get_row_text(machine):
+    """
+    One dashboard row, drawn from a consistent snapshot of the machine.
+
+    A row whose specs didn't change and whose animation has settled looks
+    the same every frame, it is reused instead of being drawn again.
+    """
+    version, specs = STATE.snapshot(machine)
+    text_specs = MACHINE_TEXT_SPECS[machine]
+    key = (version, current_remote_version())
+    cached = ROWS.get(machine)
+    # reset_masks swaps in new masks, that invalidates the row as well
+    if cached is not None and cached[0] == key and cached[1] is text_specs:
+        return cached[2]
+
+    row = "│ " + get_machine_text(machine, specs) + " │ " + get_automation_text(machine, specs) + " │ " + get_version_text(machine, specs) + " │  " + get_generation_text(machine, specs) + " │ " + get_build_time_text(machine, specs) + " │\n"
+    if row_settled(text_specs):
+        ROWS[machine] = (key, text_specs, row)
+    return row
+
+def shows_problem(machine):
+    is_online, _ = current_spec(machine, "is_online")
+    if is_online in ["false", "timeout"]:
+        return True
+    return is_online == "true" and has_problem(machine)
+
+def build_hours(last_build):
+    # "3d 4h" or "4h", None if there is no build age
+    try:
+        if "d" in last_build:
+            days, hours = last_build.split("d")
+            return int(days) * 24 + int(hours.strip().rstrip("h"))
+        return int(last_build.rstrip("h"))
+    except ValueError:
+        return None
+
+def sort_key(sort):
+    remote_version, _ = current_remote_version()
+
+    def build_age_key(machine):
+        hours = build_hours(current_spec(machine, "last_build")[0])
+        # oldest builds first, machines without one at the end
+        return (hours is None, -(hours or 0))
+
+    def generation_key(machine):
+        generation = current_spec(machine, "generation")[0]
+        return (not generation.isdigit(), int(generation) if generation.isdigit() else 0)
+
+    def version_key(machine):
+        version = current_spec(machine, "nixos_version")[0]
+        if version in ["unset", "none"] or remote_version in ["unset", "unknown", "timeout"]:
+            return 3
+        if version in ["unknown", "timeout"]:
+            return 1
+        # mismatches first
+        return 0 if version != remote_version else 2
+
+    return {"build-age": build_age_key, "generation": generation_key, "version": version_key}[sort]
+
+def ordered_machines(this_machine):
+    """
+    The machines below the pinned local one, filtered and sorted like VIEW
+    says. Only recomputed when a spec or the view changed.
+    """
+    global ORDER
+    key = (STATE.version, CACHED_REMOTE_VERSION, VIEW.sort, VIEW.problems_only)
+    if ORDER[0] == key:
+        return ORDER[1]
+    machines = [machine for machine in MACHINE_LIST if machine != this_machine]
+    if VIEW.problems_only:
+        machines = [machine for machine in machines if shows_problem(machine)]
+    if VIEW.sort != "name":
+        # stable, so machines with equal keys keep the configured order
+        machines.sort(key=sort_key(VIEW.sort))
+    ORDER = (key, machines)
+    return machines
+
+def assemble_text(height=None):
+    """
+    The dashboard. With a `height`, only as many rows as fit into that many
+    lines are drawn, starting at the scroll position of VIEW, followed by a
+    status line.
+    """
+    global VISIBLE
+    separator = "├" + "─" * (4 + MAX_MACHINE_LENGTH) + "┼───┼────────────┼───────┼────────────┤\n"
+    # joined once at the end, adding up thousands of rows is quadratic
+    parts: list[str] = [
+        "╭" + "─" * (4 + MAX_MACHINE_LENGTH) + "┬───┬────────────┬───────┬────────────╮\n",
+        "│ " + "machine".rjust(2 + MAX_MACHINE_LENGTH) + " │aut│ v " + get_remote_version_text() + " │  gen. │      built │\n",
+        separator,
+        ]
+
+    this_machine = commands.this_machine()
+    visible = []
+    if this_machine in MACHINE_LIST and not (VIEW.problems_only and not shows_problem(this_machine)):
+        visible.append(this_machine)
+        parts.append(get_row_text(this_machine))
+        parts.append(separator)
+
+    machines = ordered_machines(this_machine)
+    if height is None:
+        start, rows = 0, machines
+    else:
+        # the borders, the pinned row and the status line take the rest
+        start, rows = VIEW.window(machines, max(1, height - len(parts) - 2))
+    for machine in rows:
+        parts.append(get_row_text(machine))
+    visible += rows
+    VISIBLE = visible
+
+    bottom = "╰" + "─" * (4 + MAX_MACHINE_LENGTH) + "┴───┴────────────┴───────┴────────────╯"
+    parts.append(bottom)
+    if height is not None:
+        # a wrapped line would throw off the cursor movements of the screen
+        parts.append("\n" + VIEW.status(start, len(rows), len(machines))[:len(bottom)])
+
+    return "".join(parts)
+
+def print_record(record):
+    line = json.dumps(record) + "\n"
+    output = OUTPUT or sys.stdout
+    # relay results arrive on a thread of their own
+    with PRINT_LOCK:
+        output.write(line)
+        output.flush()
+
+def machine_record(machine):
+    return {"type": "machine", "machine": machine, **api.matched_specs(STATE, machine)}
+
+def merge_relayed(reported, on_result=None):
+    """
+    Returns the handler for the records of relays: the specs go into the
+    state store, a machine that changes after its first report replays its
+    reveal animation.
+    """
+    def on_record(record):
+        machine = record["machine"]
+        if STATE.update(machine, record) and machine in reported:
+            reset_masks(machine)
+        reported.add(machine)
+        record_history([machine])
+        if on_result is not None:
+            on_result(machine)
+
+    return on_record
+
+def finish_relays(relays, reported, timeout, on_result=None):
+    """
+    Wait for the last results of the relays. Machines they didn't report in
+    time are flagged as timed out, those of a relay that hung up early as
+    unknown.
+    """
+    finished = relays.wait(timeout)
+    for machine in relays.machines:
+        if machine in reported:
+            continue
+        if finished:
+            STATE.update(machine, {field: "unknown" for field in ["is_online", *api.PROBED]})
+        else:
+            api.mark_timeouts(STATE, machine)
+        if on_result is not None:
+            on_result(machine)
 
-    dashboard_string: str = ""
-    dashboard_string += "╭" + "─" * (4 + MAX_MACHINE_LENGTH) + "┬───┬────────────┬───────┬────────────╮\n"
-    dashboard_string += "│ " + "machine".rjust(2 + MAX_MACHINE_LENGTH) + " │aut│ v " + get_remote_version_text() + " │  gen. │      built │\n"
-    dashboard_string += "├" + "─" * (4 + MAX_MACHINE_LENGTH) + "┼───┼────────────┼───────┼────────────┤\n"
+def print_json(arguments, machines, remote_version, cache_data, relays=None):
+    """
+    Write one JSON object per line instead of drawing the dashboard: a
+    "machines" record announcing the machines, one "machine" record per
+    machine as soon as its scan finished, followed by a "summary" record.
 
-    if commands.this_machine in MACHINE_LIST:
-        this_machine = commands.this_machine
-        dashboard_string += "│ " + get_machine_text(this_machine) +  " │ " + get_automation_text(this_machine) + " │ " + get_version_text(this_machine) + " │  " + get_generation_text(this_machine) + " │ " + get_build_time_text(this_machine) +" │\n"
-        dashboard_string += "├" + "─" * (4 + MAX_MACHINE_LENGTH) + "┼───┼────────────┼───────┼────────────┤\n"
+    The "machines" record comes first, so this output can feed the dashboard
+    of another instance, see relay.Relay.
+    """
+    started = time.time()
+    start = time.perf_counter()
 
+    print_record({"type": "machines", "machines": MACHINE_LIST})
+
+    # from the cache, these are not scanned
     for machine in MACHINE_LIST:
-        if machine != commands.this_machine:
-            dashboard_string += "│ " + get_machine_text(machine) + " │ " + get_automation_text(machine) + " │ " + get_version_text(machine) + " │  " + get_generation_text(machine) + " │ " + get_build_time_text(machine) +" │\n"
+        if machine not in machines and machine not in RELAYED:
+            print_record(machine_record(machine))
+
+    on_result = lambda machine: print_record(machine_record(machine))
+    reported: set[str] = set()
+    if relays is not None:
+        relays.follow(merge_relayed(reported, on_result))
+
+    if arguments.watch:
+        # runs until interrupted
+        asyncio.run(watch_fleet(arguments, machines, remote_version, cache_data, on_result))
+
+    asyncio.run(scan_fleet(arguments, machines, remote_version, on_result))
+    record_history(machines)
+    if relays is not None:
+        finish_relays(relays, reported, arguments.deadline, on_result)
+    if cache_data is not None:
+        save_cache(cache_data, machines + sorted(RELAYED), remote_version)
+
+    remote_version_value, stale = current_remote_version()
+    print_record({
+        "type": "summary",
+        "remote_version": remote_version_value,
+        "remote_version_cached": stale,
+        "machines": len(MACHINE_LIST),
+        "scanned": len(machines),
+        "relayed": len(RELAYED),
+        "started": datetime.fromtimestamp(started, timezone.utc).isoformat(),
+        "duration": round(time.perf_counter() - start, 3),
+        })
+
+def masks_settled():
+    if not VERSION_TEXT_SPECS["version_mask"].settled:
+        return False
+    # rows off screen don't animate
+    return all(row_settled(MACHINE_TEXT_SPECS[machine]) for machine in VISIBLE)
+
+def data_signature():
+    return STATE.version, CACHED_REMOTE_VERSION, VIEW.changed
+
+def print_text(max_fps=render.MAX_FPS, stream=None, height=None):
+    """
+    Draw the dashboard until DONE. On a terminal only as many rows as fit
+    are drawn, `height` overrides the number of lines.
+    """
+    global DONE
 
-    dashboard_string += "╰" + "─" * (4 + MAX_MACHINE_LENGTH) + "┴───┴────────────┴───────┴────────────╯"
+    screen = render.Screen(stream)
+    frame_time = max(DELAY, 1 / max_fps)
+    last_signature = None
+    while not DONE:
+        lines = height or view.terminal_height(screen.stream)
+        signature = (data_signature(), lines)
+        # nothing is animating and nothing changed, stay idle
+        if not (masks_settled() and signature == last_signature):
+            screen.draw(assemble_text(lines))
+            FIRST_FRAME.set()
+        last_signature = signature
+        time.sleep(frame_time)
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="fleet",
+        description="Fleet monitoring for Nix/NixOS machines.",
+        epilog="Configure with the environment variables FLEET_MACHINES (space separated host names), FLEET_REPO_URL (GitLab commits API url) and optionally FLEET_PAT_TOKEN.",
+        )
+    parser.add_argument("--concurrency", type=int, default=scan.CONCURRENCY, help=f"maximum number of queries running at once (default: {scan.CONCURRENCY})")
+    parser.add_argument("--per-host", type=int, default=scan.PER_HOST_CONCURRENCY, help=f"maximum number of queries running against one machine at once (default: {scan.PER_HOST_CONCURRENCY})")
+    parser.add_argument("--starts-per-host", type=int, default=admission.STARTS_PER_HOST, help=f"maximum number of ssh connections being set up to one machine at once (default: {admission.STARTS_PER_HOST})")
+    parser.add_argument("--starts-per-jump-host", type=int, default=admission.STARTS_PER_JUMP_HOST, help=f"maximum number of ssh connections being set up through one jump host at once, keep it below its sshd MaxStartups (default: {admission.STARTS_PER_JUMP_HOST})")
+    parser.add_argument("--retries", type=int, default=admission.RETRIES, help=f"times an ssh connection dropped by a connection limit is retried (default: {admission.RETRIES})")
+    parser.add_argument("--ping", action="store_true", help="check whether machines are online with ping instead of connecting to their ssh port")
+    parser.add_argument("--ssh-port", type=int, default=reachability.SSH_PORT, help=f"port checked to decide whether a machine is online when ssh_config has none for it (default: {reachability.SSH_PORT})")
+    parser.add_argument("--connect-timeout", type=float, default=reachability.TIMEOUT, help=f"seconds to wait for the ssh port of a machine (default: {reachability.TIMEOUT})")
+    parser.add_argument("--timeout", type=float, default=commands.COMMAND_TIMEOUT, help=f"seconds a single remote command may take (default: {commands.COMMAND_TIMEOUT})")
+    parser.add_argument("--deadline", type=float, default=DEADLINE, help=f"seconds the whole scan may take, late machines are shown as timed out (default: {DEADLINE})")
+    parser.add_argument("--cache-ttl", type=float, default=cache.CACHE_TTL, help=f"seconds after which cached results count as outdated (default: {cache.CACHE_TTL})")
+    parser.add_argument("--full-scan", action="store_true", help="probe every machine in full, instead of only those whose fingerprint (system profile, current system, last nixos-upgrade run) changed since the last probe")
+    parser.add_argument("--skip-fresh", action="store_true", help="don't scan machines whose cached results are younger than --cache-ttl")
+    parser.add_argument("--max-fps", type=float, default=render.MAX_FPS, help=f"maximum number of dashboard redraws per second (default: {render.MAX_FPS})")
+    parser.add_argument("--sort", choices=view.SORTS, default="name", help="order of the machines, press s to change it: configured order, oldest build, generation, or version mismatches first (default: name)")
+    parser.add_argument("--problems", action="store_true", help="only show machines that are offline, failed to build or run another version, press p to toggle")
+    parser.add_argument("--json", action="store_true", help="print one JSON record per machine and a summary record (NDJSON) instead of the dashboard")
+    parser.add_argument("--watch", action="store_true", help="keep the dashboard open and keep polling the machines")
+    parser.add_argument("--no-cache", action="store_true", help="neither read nor write the results cache")
+    parser.add_argument("--profile", action="store_true", help="time every query and print the slowest machines and queries when done")
+    parser.add_argument("--relay", metavar="SOURCE", action="append", default=[], help="show the machines of a relay: a command printing the --json output of another fleet instance (e.g. \"ssh bastion fleet --json\") or unix:PATH for one started with --serve PATH, repeatable")
+    parser.add_argument("--serve", metavar="PATH", help="wait for a dashboard to connect to the unix socket PATH and send it the --json output")
+    parser.add_argument("--exporter", metavar="[HOST:]PORT", nargs="?", const=str(exporter.PORT), help=f"scan in the background and serve the latest results as Prometheus metrics on http://HOST:PORT/metrics instead of showing them (default: 127.0.0.1:{exporter.PORT})")
+    parser.add_argument("--exporter-interval", type=float, default=exporter.INTERVAL, help=f"seconds between the starts of two --exporter scans (default: {exporter.INTERVAL})")
+    parser.add_argument("--agent", action="store_true", help="write the status document of this machine and exit, run it from a timer and from OnSuccess=/OnFailure= of nixos-upgrade.service")
+    parser.add_argument("--status-file", metavar="PATH", default=commands.STATUS_PATH, help=f"status document written by --agent and read from every machine before probing it (default: {commands.STATUS_PATH})")
+    parser.add_argument("--status-max-age", type=float, default=commands.STATUS_MAX_AGE, help=f"seconds after which a status document is ignored and the machine is probed, --agent rewrites an unchanged one after half of it (default: {commands.STATUS_MAX_AGE})")
+    parser.add_argument("--no-history", action="store_true", help="don't append the results to the scan history")
+    parser.add_argument("--history", choices=["drift", "churn", "failures"], help="report from the scan history and exit: how long machines have been behind the remote version, how often their generation changed, or their streaks of failed builds")
+    parser.add_argument("--machine", help="limit --history to one machine")
+    parser.add_argument("--since", type=float, metavar="DAYS", help="limit --history churn and failures to the last DAYS days")
+    parser.add_argument("--trace", metavar="FILE", help="write the timing of every query to FILE in the Chrome trace event format")
+    return parser.parse_args(argv)
+
+def finish_profile(arguments):
+    if arguments.trace:
+        timing.write_trace(arguments.trace)
+    if arguments.profile:
+        # keep stdout clean for --json consumers
+        stream = sys.stderr if arguments.json else sys.stdout
+        print(timing.report(), file=stream)
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
+
+def print_history(arguments):
+    """
+    Report from the scan history, without any network access.
+    """
+    store = history.History()
+    since = None if arguments.since is None else time.time() - arguments.since * 86400
+    if arguments.history == "drift":
+        report = store.drift(arguments.machine)
+    elif arguments.history == "churn":
+        report = store.churn(arguments.machine, since)
+    else:
+        report = store.failures(arguments.machine, since)
+    store.close()
 
-    return dashboard_string
+    if arguments.json:
+        for entry in report:
+            print_record({"type": arguments.history, **entry})
+        return
 
-def print_text():
-    global DONE
+    width = max([len(entry["machine"]) for entry in report] + [len("machine")])
+    if arguments.history == "drift":
+        print(f"{'machine':>{width}}  {'behind since':<16}  {'for':>7}  {'version':<8}  {'remote':<8}")
+        for entry in report:
+            print(f"{entry['machine']:>{width}}  {format_time(entry['behind_since']):<16}  {commands.build_age(datetime.fromtimestamp(entry['behind_since'])):>7}  {entry['nixos_version']:<8}  {entry['remote_version']:<8}")
+    elif arguments.history == "churn":
+        print(f"{'machine':>{width}}  {'changes':>7}  {'generations':>13}  {'scans':>6}")
+        for entry in report:
+            generations = f"{entry['first_generation']}-{entry['last_generation']}" if entry["first_generation"] else "?"
+            print(f"{entry['machine']:>{width}}  {entry['changes']:>7}  {generations:>13}  {entry['scans']:>6}")
+    else:
+        print(f"{'machine':>{width}}  {'streak':>6}  {'failing since':<16}  {'longest':>7}  {'failed':>6}  {'scans':>6}")
+        for entry in report:
+            failing_since = format_time(entry["failing_since"]) if entry["failing_since"] else ""
+            print(f"{entry['machine']:>{width}}  {entry['current_streak']:>6}  {failing_since:<16}  {entry['longest_streak']:>7}  {entry['failed_scans']:>6}  {entry['scans']:>6}")
 
-    number_of_previous_lines = 0
-    while not DONE:
-        text = assemble_text()
-        print(f"\033[{number_of_previous_lines + 2}A")  # reset screen
-        number_of_previous_lines = text.count('\n')
-        print(text)
-        time.sleep(DELAY)
+def start_relays(sources):
+    relays = relay.Relays(sources)
+    try:
+        relays.start()
+    except TimeoutError:
+        relays.close()
+        sys.exit(f"fleet: the relays didn't announce their machines within {relay.CONNECT_TIMEOUT}s")
+    except (OSError, ConnectionError) as e:
+        relays.close()
+        sys.exit(f"fleet: {e}")
+    return relays
+
+def run_exporter(arguments):
+    metrics = exporter.Exporter(
+        MACHINE_LIST,
+        URL,
+        PAT_TOKEN,
+        arguments.exporter_interval,
+        incremental=not arguments.full_scan,
+        concurrency=arguments.concurrency,
+        per_host=arguments.per_host,
+        timeout=arguments.timeout,
+        deadline=arguments.deadline,
+        ping=arguments.ping,
+        ssh_port=arguments.ssh_port,
+        connect_timeout=arguments.connect_timeout,
+        status_path=arguments.status_file,
+        status_max_age=arguments.status_max_age,
+        starts=admission.Admission(arguments.starts_per_host, arguments.starts_per_jump_host, retries=arguments.retries),
+        )
+    try:
+        server = exporter.serve(metrics, arguments.exporter)
+    except (OSError, ValueError) as e:
+        sys.exit(f"fleet: can't serve metrics on {arguments.exporter}: {e}")
+    try:
+        asyncio.run(metrics.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
 
 def main():
-    global DONE
-    main_loop = threading.Thread(target=print_text, args=(), daemon=True)
-    tasks = []
-    for machine in MACHINE_LIST:
-        tasks.append(threading.Thread(target=get_machine_specs, args=(machine,), daemon=True))
-    tasks.append(threading.Thread(target=get_remote_version, args=(URL, PAT_TOKEN), daemon=True))
+    global DONE, OUTPUT, HISTORY, INCREMENTAL
+    arguments = parse_arguments()
+    if arguments.agent:
+        try:
+            agent.update(arguments.status_file, refresh=arguments.status_max_age / 2)
+        except (OSError, ValueError, subprocess.SubprocessError) as e:
+            sys.exit(f"fleet: can't write the status document: {e}")
+        return
+    if arguments.history:
+        print_history(arguments)
+        return
+    if arguments.exporter:
+        try:
+            configure_from_environment()
+        except KeyError as e:
+            sys.exit(f"fleet: please set the environment variable {e}, see fleet --help")
+        run_exporter(arguments)
+        return
+    if arguments.serve:
+        arguments.json = True
+
+    relays = start_relays(arguments.relay) if arguments.relay else None
+    try:
+        configure_from_environment(relayed=relays.machines if relays is not None else ())
+    except KeyError as e:
+        sys.exit(f"fleet: please set the environment variable {e}, see fleet --help")
+    colors.init()
+    timing.ENABLED = arguments.profile or arguments.trace is not None
+    INCREMENTAL = not arguments.full_scan
+    if not arguments.no_history:
+        try:
+            HISTORY = history.History()
+        except (OSError, history.sqlite3.Error):
+            pass
 
-    main_loop.start()
-    for task in tasks:
-        task.start()
+    if arguments.no_cache:
+        cache_data = None
+        machines = MACHINE_LIST
+    else:
+        cache_data = cache.load()
+        machines = load_cache(cache_data, arguments.cache_ttl, arguments.skip_fresh)
+    # the relays scan their own machines
+    machines = [machine for machine in machines if machine not in RELAYED]
+
+    if not arguments.json:
+        VIEW.sort = arguments.sort
+        VIEW.problems_only = arguments.problems
+        threading.Thread(target=view.read_keys, args=(VIEW,), daemon=True).start()
+        atexit.register(view.restore_terminal)
+        main_loop = threading.Thread(target=print_text, args=(arguments.max_fps,), daemon=True)
+        main_loop.start()
+        # the empty table goes up before asyncio and http.client are even imported
+        FIRST_FRAME.wait(1)
+
+    entry = None if cache_data is None else cache.remote_version_entry(cache_data, URL)
+    remote_version = remote.RemoteVersion(URL, PAT_TOKEN, arguments.timeout, entry)
+
+    if arguments.json:
+        try:
+            if arguments.serve:
+                OUTPUT = relay.serve(arguments.serve)
+            print_json(arguments, machines, remote_version, cache_data, relays)
+        except (KeyboardInterrupt, BrokenPipeError):
+            exit(1)
+        finally:
+            if relays is not None:
+                relays.close()
+            finish_profile(arguments)
+        return
+
+    reported: set[str] = set()
+    if relays is not None:
+        relays.follow(merge_relayed(reported))
 
     try:
-        for task in tasks:
-            task.join()
+        if arguments.watch:
+            # runs until interrupted
+            asyncio.run(watch_fleet(arguments, machines, remote_version, cache_data))
+
+        asyncio.run(scan_fleet(arguments, machines, remote_version))
+        record_history(machines)
+        if relays is not None:
+            finish_relays(relays, reported, arguments.deadline)
+        if cache_data is not None:
+            save_cache(cache_data, machines + sorted(RELAYED), remote_version)
 
         time.sleep(DELAY*(8+5))
         DONE = True
         main_loop.join()
     except KeyboardInterrupt:
+        DONE = True
+        main_loop.join()
         exit(1)
+    finally:
+        if relays is not None:
+            relays.close()
+        finish_profile(arguments)
 
 if __name__ == "__main__":
     main()
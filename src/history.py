@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+import threading
+import time
+
+import state
+
+# specs that don't carry a value to compare
+PLACEHOLDERS = ["unset", "unknown", "timeout", "none"]
+
+SCHEMA = """\
+CREATE TABLE IF NOT EXISTS results (
+    time REAL NOT NULL,
+    machine TEXT NOT NULL,
+    remote_version TEXT NOT NULL,
+    is_online TEXT NOT NULL,
+    automation_status TEXT NOT NULL,
+    nixos_version TEXT NOT NULL,
+    nixos_version_match TEXT NOT NULL,
+    generation TEXT NOT NULL,
+    last_build TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_machine_time ON results (machine, time);
+CREATE INDEX IF NOT EXISTS results_time ON results (time);
+"""
+
+
+def history_path():
+    state_home = os.environ.get("XDG_STATE_HOME") or os.path.join(os.path.expanduser("~"), ".local", "state")
+    return os.path.join(state_home, "fleet", "history.sqlite")
+
+
+class History:
+    """
+    Every scan result of every machine, one row each, together with the
+    remote version at the time of the scan.
+
+    Rows are only ever appended. The trend queries read them back ordered
+    by machine and time, which the (machine, time) index serves without
+    sorting.
+    """
+
+    def __init__(self, path=None):
+        path = path or history_path()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # relay results are recorded from a thread of their own
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def record(self, results, remote_version, now=None):
+        """
+        Append `results`, a list of (machine, specs) pairs, as one scan.
+        """
+        now = time.time() if now is None else now
+        rows = [
+            (now, machine, remote_version, *[specs[field] for field in state.FIELDS])
+            for machine, specs in results
+            if specs["is_online"] != "unset"
+            ]
+        with self.lock, self.connection:
+            self.connection.executemany(f"INSERT INTO results VALUES (?, ?, ?, {', '.join('?' * len(state.FIELDS))})", rows)
+
+    def rows(self, machine=None, since=None):
+        """
+        Yields (machine, time, remote_version, specs) ordered by machine and time.
+        """
+        query = "SELECT machine, time, remote_version, " + ", ".join(state.FIELDS) + " FROM results"
+        conditions = []
+        parameters: list = []
+        if machine is not None:
+            conditions.append("machine = ?")
+            parameters.append(machine)
+        if since is not None:
+            conditions.append("time >= ?")
+            parameters.append(since)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY machine, time"
+        with self.lock:
+            rows = self.connection.execute(query, parameters).fetchall()
+        for row in rows:
+            yield row[0], row[1], row[2], dict(zip(state.FIELDS, row[3:]))
+
+    def by_machine(self, machine=None, since=None):
+        current = None
+        group: list = []
+        for row in self.rows(machine, since):
+            if row[0] != current and group:
+                yield current, group
+                group = []
+            current = row[0]
+            group.append(row[1:])
+        if group:
+            yield current, group
+
+    def drift(self, machine=None, now=None):
+        """
+        For every machine whose last known version differs from the remote
+        version at that time: since when it has been behind.
+        """
+        now = time.time() if now is None else now
+        report = []
+        for name, rows in self.by_machine(machine):
+            known = [(when, remote_version, specs["nixos_version"]) for when, remote_version, specs in rows
+                     if remote_version not in PLACEHOLDERS and specs["nixos_version"] not in PLACEHOLDERS]
+            if not known or known[-1][1] == known[-1][2]:
+                continue
+            since = known[-1][0]
+            for when, remote_version, version in reversed(known):
+                if remote_version == version:
+                    break
+                since = when
+            report.append({
+                "machine": name,
+                "behind_since": since,
+                "duration": now - since,
+                "nixos_version": known[-1][2],
+                "remote_version": known[-1][1],
+                })
+        return sorted(report, key=lambda entry: entry["duration"], reverse=True)
+
+    def churn(self, machine=None, since=None):
+        """
+        Number of generation changes per machine since `since`.
+        """
+        report = []
+        for name, rows in self.by_machine(machine, since):
+            generations = [specs["generation"] for _, _, specs in rows if specs["generation"] not in PLACEHOLDERS]
+            changes = sum(1 for previous, current in zip(generations, generations[1:]) if previous != current)
+            report.append({
+                "machine": name,
+                "changes": changes,
+                "first_generation": generations[0] if generations else None,
+                "last_generation": generations[-1] if generations else None,
+                "scans": len(rows),
+                })
+        return sorted(report, key=lambda entry: entry["changes"], reverse=True)
+
+    def failures(self, machine=None, since=None):
+        """
+        Failed builds per machine: the current and the longest streak of
+        scans that saw "build failed", and how many scans did in total.
+        """
+        report = []
+        for name, rows in self.by_machine(machine, since):
+            statuses = [specs["automation_status"] for _, _, specs in rows if specs["automation_status"] not in PLACEHOLDERS]
+            current = longest = total = 0
+            failing_since = None
+            for (when, _, specs) in rows:
+                status = specs["automation_status"]
+                if status in PLACEHOLDERS:
+                    continue
+                if status == "build failed":
+                    total += 1
+                    current += 1
+                    if current == 1:
+                        failing_since = when
+                    longest = max(longest, current)
+                else:
+                    current = 0
+                    failing_since = None
+            if total:
+                report.append({
+                    "machine": name,
+                    "current_streak": current,
+                    "failing_since": failing_since,
+                    "longest_streak": longest,
+                    "failed_scans": total,
+                    "scans": len(statuses),
+                    })
+        return sorted(report, key=lambda entry: (entry["current_streak"], entry["longest_streak"]), reverse=True)
@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+
+import importlib.util
+import sys
+
+
+def load(name):
+    """
+    Import `name` on first attribute access instead of right away.
+
+    For modules that are expensive to import (asyncio, http.client) but not
+    needed to parse the arguments or draw the first frame.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import atexit
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+# keep the master connection alive for this many seconds after the last use
+CONTROL_PERSIST = 60
+# seconds close_all waits for the master connections to exit
+CLOSE_TIMEOUT = 2
+
+CONTROL_DIR: str | None = None
+
+MASTERS: set[str] = set()
+POOL_LOCK = threading.Lock()
+
+
+def control_dir():
+    global CONTROL_DIR
+    with POOL_LOCK:
+        if CONTROL_DIR is None:
+            CONTROL_DIR = tempfile.mkdtemp(prefix="fleet-ssh-")
+            atexit.register(close_all)
+        return CONTROL_DIR
+
+
+def control_path(machine):
+    # unix socket paths are limited to ~100 characters, so hash long host names
+    name = hashlib.sha1(machine.encode()).hexdigest()[:16]
+    return os.path.join(control_dir(), name)
+
+
+def ssh_options(machine):
+    return [
+        "-o", f"ControlPath={control_path(machine)}",
+        "-o", "ControlMaster=no",
+        ]
+
+
+def master_command(machine):
+    return [
+        "ssh",
+        "-o", f"ControlPath={control_path(machine)}",
+        "-o", "ControlMaster=yes",
+        "-o", f"ControlPersist={CONTROL_PERSIST}",
+        "-N", "-f",
+        machine,
+        ]
+
+
+def is_open(machine):
+    return machine in MASTERS and os.path.exists(control_path(machine))
+
+
+def close_command(machine):
+    return ["ssh", "-o", f"ControlPath={control_path(machine)}", "-O", "exit", machine]
+
+
+def close_all():
+    """
+    Ask every master connection to exit, all at once and for at most
+    CLOSE_TIMEOUT seconds, a hanging one is left to ControlPersist.
+    """
+    global CONTROL_DIR
+    closing = [
+        subprocess.Popen(close_command(machine), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for machine in list(MASTERS)
+        ]
+    MASTERS.clear()
+    deadline = time.monotonic() + CLOSE_TIMEOUT
+    for process in closing:
+        try:
+            process.wait(max(0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+    if CONTROL_DIR is not None:
+        shutil.rmtree(CONTROL_DIR, ignore_errors=True)
+        CONTROL_DIR = None
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import socket
+
+import lazy
+import timing
+
+asyncio = lazy.load("asyncio")
+
+SSH_PORT = 22
+# seconds to wait for the ssh port to accept a connection
+TIMEOUT = 2.0
+# maximum number of connection attempts in flight, each holds a socket
+CONCURRENCY = 256
+
+
+class Reachability:
+    """
+    Checks whether machines accept connections on their ssh port and greet
+    with an ssh banner.
+
+    All checks run as non-blocking connects on the event loop, so a whole
+    fleet is checked within about one `timeout`. Name resolution and results
+    are cached for the lifetime of the instance, i.e. for one scan. `port`
+    is used for hosts checked without one.
+    """
+
+    def __init__(self, port=SSH_PORT, timeout=TIMEOUT, concurrency=CONCURRENCY):
+        self.port = port
+        self.timeout = timeout
+        self.slots = asyncio.Semaphore(concurrency)
+        self.addresses: dict[tuple[str, int], list[tuple]] = {}
+        self.checks: dict[str, asyncio.Task] = {}
+
+    async def resolve(self, host, port):
+        if (host, port) not in self.addresses:
+            loop = asyncio.get_running_loop()
+            infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+            self.addresses[host, port] = [(family, address) for family, _, _, _, address in infos]
+        return self.addresses[host, port]
+
+    async def connect(self, host, port):
+        try:
+            async with asyncio.timeout(self.timeout):
+                addresses = await self.resolve(host, port)
+                for family, address in addresses:
+                    try:
+                        reader, writer = await asyncio.open_connection(address[0], address[1], family=family)
+                    except OSError:
+                        continue
+                    try:
+                        # sshd greets first, a bare accept() could also be a proxy or firewall
+                        banner = await reader.readline()
+                    finally:
+                        writer.close()
+                    return banner.startswith(b"SSH-")
+        except (OSError, TimeoutError):
+            pass
+        return False
+
+    async def _check(self, machine, host, port):
+        async with self.slots:
+            # once per check, however many callers await its task
+            with timing.measure(machine, "is_online") as measurement:
+                online = await self.connect(host, port)
+                measurement.status = "online" if online else "offline"
+        return online
+
+    def check(self, machine, host=None, port=None):
+        """
+        Start checking `machine` at `host` (default the machine name) and
+        `port` unless that already happened, returns the task holding the
+        result.
+        """
+        if machine not in self.checks:
+            self.checks[machine] = asyncio.create_task(self._check(machine, host or machine, port or self.port))
+        return self.checks[machine]
+
+    def forget(self, machine):
+        """
+        Drop the result for `machine`, the next check connects again.
+        """
+        self.checks.pop(machine, None)
+
+    async def is_online(self, machine, host=None, port=None):
+        return await self.check(machine, host, port)
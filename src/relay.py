@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import signal
+import socket
+import subprocess
+import threading
+
+import lazy
+
+asyncio = lazy.load("asyncio")
+
+# seconds to wait for all relays to start and announce their machines
+CONNECT_TIMEOUT = 30
+# longest accepted record, the "machines" record of a large site is one line
+LINE_LIMIT = 16 * 1024 * 1024
+
+
+class Relay:
+    """
+    A `fleet --json` instance scanning the machines of one site, usually on
+    that site's jump host.
+
+    The source is either a shell command whose stdout carries the records,
+    e.g. "ssh bastion-a fleet --json", or "unix:PATH" for a relay started
+    with `fleet --serve PATH`. The first record of a relay announces its
+    machines, see fleet.print_json.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.machines: list[str] = []
+        self.reader: asyncio.StreamReader | None = None
+        self.writer: asyncio.StreamWriter | None = None
+        self.process: asyncio.subprocess.Process | None = None
+
+    async def open(self):
+        """
+        Start or connect to the relay and wait for its "machines" record.
+        """
+        if self.source.startswith("unix:"):
+            self.reader, self.writer = await asyncio.open_unix_connection(self.source.removeprefix("unix:"), limit=LINE_LIMIT)
+        else:
+            self.process = await asyncio.create_subprocess_shell(self.source, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, limit=LINE_LIMIT, start_new_session=True)
+            self.reader = self.process.stdout
+
+        async for record in self.records():
+            if record["type"] == "machines":
+                self.machines = [machine for machine in record["machines"] if isinstance(machine, str)]
+                return self.machines
+        raise ConnectionError(f"relay {self.source!r} hung up before announcing its machines")
+
+    async def records(self):
+        """
+        Yield the records of the relay until it hangs up, lines that aren't
+        records are skipped.
+        """
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                return
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and "type" in record:
+                yield record
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.process is not None and self.process.returncode is None:
+            os.killpg(self.process.pid, signal.SIGKILL)
+            await self.process.wait()
+
+
+class Relays:
+    """
+    All relays of a dashboard, read by an event loop in a thread of its own.
+
+    The local scan keeps its own loop in the main thread, results of both
+    meet in the thread-safe state store.
+    """
+
+    def __init__(self, sources):
+        self.relays = [Relay(source) for source in sources]
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.following = None
+
+    @property
+    def machines(self):
+        return [machine for relay in self.relays for machine in relay.machines]
+
+    def start(self, timeout=CONNECT_TIMEOUT):
+        """
+        Start all relays and wait for them to announce their machines.
+        """
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.open(timeout), self.loop).result()
+
+    async def open(self, timeout):
+        async with asyncio.timeout(timeout):
+            await asyncio.gather(*[relay.open() for relay in self.relays])
+
+    def follow(self, on_record):
+        """
+        Call `on_record(record)` for every "machine" record of a machine the
+        relay announced, until every relay sent its summary or hung up.
+        """
+        self.following = asyncio.run_coroutine_threadsafe(self.follow_all(on_record), self.loop)
+
+    async def follow_all(self, on_record):
+        await asyncio.gather(*[self.follow_relay(relay, on_record) for relay in self.relays])
+
+    async def follow_relay(self, relay, on_record):
+        async for record in relay.records():
+            if record["type"] == "machine" and record.get("machine") in relay.machines:
+                on_record(record)
+            elif record["type"] == "summary":
+                return
+
+    def wait(self, timeout=None):
+        """
+        Wait for all relays to finish, returns False if they didn't in time.
+        """
+        try:
+            self.following.result(timeout)
+        except TimeoutError:
+            return False
+        return True
+
+    def close(self):
+        if self.thread.is_alive():
+            asyncio.run_coroutine_threadsafe(self.close_all(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+
+    async def close_all(self):
+        if self.following is not None:
+            self.following.cancel()
+        await asyncio.gather(*[relay.close() for relay in self.relays])
+
+
+def serve(path):
+    """
+    Wait for one dashboard to connect to the unix socket at `path` and return
+    a text stream to write the records to.
+    """
+    if os.path.exists(path):
+        os.unlink(path)  # left behind by an earlier relay
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(path)
+        server.listen(1)
+        connection, _ = server.accept()
+    finally:
+        server.close()
+        if os.path.exists(path):
+            os.unlink(path)
+    return connection.makefile("w", encoding="utf-8")
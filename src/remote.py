@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import http.client
+import json
+import urllib.parse
+
+# seconds to wait for the repository API
+TIMEOUT = 10
+
+
+class RemoteVersion:
+    """
+    Fetches the newest commit of the configuration repository from the GitLab
+    commits API.
+
+    Only one commit is requested (per_page=1) over a kept-alive connection.
+    The ETag and Last-Modified headers of the last answer are sent back as
+    conditional request headers, so an unchanged repository costs a body-less
+    304 Not Modified.
+    """
+
+    def __init__(self, url, pat=None, timeout=TIMEOUT, entry=None):
+        self.url = url
+        self.pat = pat
+        self.timeout = timeout
+        self.connection: http.client.HTTPConnection | None = None
+
+        parts = urllib.parse.urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        query = urllib.parse.parse_qsl(parts.query)
+        query = [(key, value) for key, value in query if key != "per_page"] + [("per_page", "1")]
+        self.path = urllib.parse.urlunsplit(("", "", parts.path or "/", urllib.parse.urlencode(query), ""))
+
+        # a cache entry of an earlier run, see cache.set_remote_version
+        entry = entry or {}
+        self.version: str | None = entry.get("version")
+        self.etag: str | None = entry.get("etag")
+        self.last_modified: str | None = entry.get("last_modified")
+
+    def connect(self):
+        if self.connection is None:
+            if self.scheme == "https":
+                self.connection = http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+            else:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self.connection
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def headers(self):
+        headers = {"Accept": "application/json"}
+        if self.pat:
+            headers["PRIVATE-TOKEN"] = self.pat
+        # only ask conditionally if there is a version to fall back to
+        if self.version is not None:
+            if self.etag:
+                headers["If-None-Match"] = self.etag
+            if self.last_modified:
+                headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def request(self):
+        connection = self.connect()
+        connection.request("GET", self.path, headers=self.headers())
+        response = connection.getresponse()
+        body = response.read()
+        return response, body
+
+    def fetch(self):
+        try:
+            response, body = self.request()
+        except TimeoutError:
+            self.close()
+            raise
+        except (http.client.HTTPException, OSError):
+            # the server may have dropped the kept-alive connection, retry once
+            self.close()
+            response, body = self.request()
+
+        if response.status == http.client.NOT_MODIFIED and self.version is not None:
+            return self.version
+        if response.status != http.client.OK:
+            raise http.client.HTTPException(f"{self.url} answered {response.status} {response.reason}")
+
+        self.version = json.loads(body)[0]["short_id"]
+        self.etag = response.getheader("ETag")
+        self.last_modified = response.getheader("Last-Modified")
+        return self.version
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import re
+import sys
+
+# upper bound for redraws per second
+MAX_FPS = 20
+
+RESET = "\033[0m"
+
+# one visible character together with the color escapes in front of it
+CELL = re.compile(r"((?:\033\[[0-9;]*m)*)([^\033])")
+
+
+def split_cells(line):
+    """
+    Split a colored line into cells, one per visible character.
+
+    Every cell carries the escape sequences that precede its character, and
+    as `colors.color_text` resets after every character, each cell can be
+    written on its own after a reset.
+    """
+    return [prefix + char for prefix, char in CELL.findall(line)]
+
+
+class Screen:
+    """
+    Keeps the previously written frame and only sends the cells that differ
+    from it, positioned with relative cursor movements.
+
+    A frame that is identical to the previous one writes nothing at all.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.lines: list[str] = []
+
+    def draw(self, text):
+        lines = text.split("\n")
+
+        if len(lines) != len(self.lines):
+            output = self.redraw(lines)
+        else:
+            output = self.update(lines)
+
+        self.lines = lines
+        if output:
+            self.stream.write(output)
+            self.stream.flush()
+        return len(output)
+
+    def redraw(self, lines):
+        output = ""
+        if self.lines:
+            # back to the top left of the old frame, clear everything below
+            output += f"\033[{len(self.lines)}A\r\033[J"
+        for line in lines:
+            output += line + RESET + "\n"
+        return output
+
+    def update(self, lines):
+        output = ""
+        for row, (old_line, new_line) in enumerate(zip(self.lines, lines)):
+            # most rows are unchanged, only split the ones that aren't
+            if old_line == new_line:
+                continue
+            old = split_cells(old_line)
+            new = split_cells(new_line)
+            if len(old) != len(new):
+                runs = [(0, len(new))]
+            else:
+                runs = changed_runs(old, new)
+
+            up = len(self.lines) - row
+            output += f"\033[{up}A"
+            for start, end in runs:
+                output += f"\033[{start + 1}G" + RESET + "".join(new[start:end]) + RESET
+            if len(old) > len(new):
+                output += "\033[K"
+            output += f"\033[{up}B\r"
+        return output
+
+
+def changed_runs(old, new):
+    runs = []
+    start = None
+    for index, (old_cell, new_cell) in enumerate(zip(old, new)):
+        if old_cell != new_cell:
+            if start is None:
+                start = index
+        elif start is not None:
+            runs.append((start, index))
+            start = None
+    if start is not None:
+        runs.append((start, len(new)))
+    return runs
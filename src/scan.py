@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import signal
+import subprocess
+import tempfile
+
+import admission
+import commands
+import lazy
+import pool
+import timing
+
+asyncio = lazy.load("asyncio")
+
+# maximum number of subprocesses (ssh, ping) running at the same time
+CONCURRENCY = 64
+# maximum number of subprocesses running against the same remote host
+PER_HOST_CONCURRENCY = 2
+# where ssh reads its configuration, without either one every machine is
+# reached under its own name on the default port
+SSH_CONFIG_FILES = ["~/.ssh/config", "/etc/ssh/ssh_config"]
+
+
+class Scanner:
+    """
+    Runs `commands` queries as asyncio subprocesses.
+
+    The number of processes alive at any time is bounded by `concurrency`
+    overall and by `per_host` for every single machine, so memory and open
+    file descriptors stay flat no matter how large the fleet is. New ssh
+    connections additionally go through `admission`, which paces them per
+    machine and per jump host.
+    """
+
+    def __init__(self, concurrency=CONCURRENCY, per_host=PER_HOST_CONCURRENCY, reachability=None, timeout=commands.COMMAND_TIMEOUT, status_path=commands.STATUS_PATH, status_max_age=commands.STATUS_MAX_AGE, starts=None):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        # seconds before a single command is killed, raising TimeoutError
+        self.timeout = timeout
+        # None falls back to one `ping` process per machine
+        self.reachability = reachability
+        # status document of `fleet --agent`, None always probes
+        self.status_path = status_path
+        self.status_max_age = status_max_age
+        # admission.Admission pacing new ssh connections
+        self.starts = starts or admission.Admission()
+        # evaluated ssh_config of every machine, see ssh_config
+        self.configs: dict[str, dict[str, str]] = {}
+        self.has_ssh_config = any(os.path.exists(os.path.expanduser(path)) for path in SSH_CONFIG_FILES)
+        self.slots = asyncio.Semaphore(concurrency)
+        self.host_slots: dict[str, asyncio.Semaphore] = {}
+        self.master_locks: dict[str, asyncio.Lock] = {}
+
+    def host_slot(self, machine):
+        if machine not in self.host_slots:
+            self.host_slots[machine] = asyncio.Semaphore(self.per_host)
+        return self.host_slots[machine]
+
+    async def exec(self, command, stdout=subprocess.PIPE, stderr=subprocess.PIPE):
+        async with self.slots:
+            # own process group, so a timeout takes down everything the command spawned
+            process = await asyncio.create_subprocess_exec(*command, stdin=subprocess.DEVNULL, stdout=stdout, stderr=stderr, start_new_session=True)
+            try:
+                out, err = await asyncio.wait_for(process.communicate(), self.timeout)
+            finally:
+                # timed out or cancelled by the scan deadline, don't leave the process behind
+                if process.returncode is None:
+                    os.killpg(process.pid, signal.SIGKILL)
+                    await process.wait()
+        return subprocess.CompletedProcess(
+            command,
+            process.returncode,
+            out.decode(errors="replace") if out is not None else "",
+            err.decode(errors="replace") if err is not None else "",
+            )
+
+    async def ssh_config(self, machine):
+        """
+        The options ssh_config sets for `machine`, as `ssh -G` evaluates
+        them, empty if that failed or there is no ssh_config at all.
+        """
+        if not self.has_ssh_config:
+            return {}
+        if machine not in self.configs:
+            try:
+                output = await self.exec(["ssh", "-G", machine])
+            except TimeoutError:
+                output = None
+            config = {}
+            if output is not None and output.returncode == 0:
+                config = dict(line.split(" ", 1) for line in output.stdout.splitlines() if " " in line)
+            self.configs[machine] = config
+        return self.configs[machine]
+
+    async def ssh_route(self, machine):
+        """
+        The host name `machine` resolves to and the first jump host in front
+        of it (None when connecting directly), as ssh_config has them.
+        """
+        config = await self.ssh_config(machine)
+        jump_host = config.get("proxyjump", "none")
+        return config.get("hostname", machine), None if jump_host == "none" else jump_host.split(",")[0]
+
+    async def ssh_address(self, machine):
+        """
+        The (host, port) ssh connects to for `machine`, port None if
+        ssh_config doesn't tell. None when ssh goes through a jump host or a
+        proxy command, the machine itself may not be reachable from here.
+        """
+        config = await self.ssh_config(machine)
+        if config.get("proxyjump", "none") != "none" or config.get("proxycommand", "none") != "none":
+            return None
+        port = config.get("port", "")
+        return config.get("hostname", machine), int(port) if port.isdigit() else None
+
+    async def start_connection(self, machine, start):
+        """
+        Await `start()`, a call that opens a new ssh connection to `machine`,
+        when admission lets it through.
+        """
+        host, jump_host = await self.ssh_route(machine)
+        return await self.starts.run(start, host, jump_host)
+
+    async def open_master(self, machine):
+        if machine not in self.master_locks:
+            self.master_locks[machine] = asyncio.Lock()
+        async with self.master_locks[machine]:
+            if pool.is_open(machine):
+                return True
+
+            async def start():
+                # ControlPersist detaches the master, which keeps its stderr
+                # open, so it goes to a file instead of a pipe to wait on
+                with tempfile.TemporaryFile() as errors:
+                    master = await self.exec(pool.master_command(machine), stdout=subprocess.DEVNULL, stderr=errors)
+                    errors.seek(0)
+                    master.stderr = errors.read().decode(errors="replace")
+                return master
+
+            try:
+                with timing.measure(machine, "ssh_master") as measurement:
+                    master = await self.start_connection(machine, start)
+                    measurement.status = master.returncode
+            except TimeoutError:
+                return False
+            if master.returncode == 0:
+                pool.MASTERS.add(machine)
+            return False
+
+    async def run_on(self, machine, command, query="run_on"):
+        """
+        Run `command` on `machine`, recorded in `timing` under `query`
+        together with its exit status and whether it went over a master
+        connection that was already open.
+        """
+        if machine == commands.this_machine():
+            with timing.measure(machine, query) as measurement:
+                output = await self.exec(command)
+                measurement.status = output.returncode
+            return output
+
+        async with self.host_slot(machine):
+            reused = await self.open_master(machine)
+            remote_command = commands.remote_command(machine, command)
+            with timing.measure(machine, query) as measurement:
+                measurement.reused = reused
+                if pool.is_open(machine):
+                    output = await self.exec(remote_command)
+                else:
+                    # no master to go through, this connects on its own
+                    output = await self.start_connection(machine, lambda: self.exec(remote_command))
+                measurement.status = output.returncode
+        return output
+
+    async def is_online(self, machine):
+        if machine == commands.this_machine():
+            # queried without ssh, whether sshd listens doesn't matter
+            return True
+        if self.reachability is not None:
+            address = await self.ssh_address(machine)
+            # behind a jump host only connecting with ssh tells, leave that to the queries
+            return True if address is None else await self.reachability.is_online(machine, *address)
+        with timing.measure(machine, "is_online") as measurement:
+            # not through run_on, the time belongs to the pinged machine
+            online = commands.parse_is_online(await self.exec(commands.ping_command(machine)))
+            measurement.status = "online" if online else "offline"
+        return online
+
+    async def automation_status(self, machine):
+        return commands.parse_automation_status(await self.run_on(machine, commands.AUTOMATION_STATUS_COMMAND, "automation_status"))
+
+    async def nixos_version(self, machine):
+        return commands.parse_nixos_version(await self.run_on(machine, commands.NIXOS_VERSION_COMMAND, "nixos_version"))
+
+    async def generation(self, machine):
+        return commands.parse_generation(await self.run_on(machine, commands.GENERATION_COMMAND, "generation"))
+
+    async def last_build(self, machine):
+        return commands.parse_last_build(await self.run_on(machine, commands.LAST_BUILD_COMMAND, "last_build"))
+
+    async def fingerprint(self, machine):
+        return commands.parse_fingerprint(await self.run_on(machine, commands.FINGERPRINT_COMMAND, "fingerprint"))
+
+    async def status_payload(self, machine):
+        """
+        The status document of the machine, or the probe payload if it has
+        none. A stale document costs a second call.
+        """
+        if self.status_path is not None:
+            output = await self.run_on(machine, commands.status_probe_command(self.status_path), "status_probe")
+            payload = commands.parse_status_payload(output, self.status_max_age)
+            if payload is not None:
+                return payload
+        return json.loads((await self.run_on(machine, commands.PROBE_COMMAND, "probe")).stdout.strip())
+
+    async def for_each(self, machines, coroutine):
+        """
+        Await `coroutine(machine)` for every machine, with at most
+        `concurrency` of them in flight.
+
+        Machines are handed to a fixed set of workers instead of creating one
+        task per machine up front.
+        """
+        queue: asyncio.Queue[str] = asyncio.Queue()
+        for machine in machines:
+            queue.put_nowait(machine)
+
+        async def worker():
+            while not queue.empty():
+                await coroutine(queue.get_nowait())
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.concurrency, len(machines)))]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
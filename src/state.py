@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import threading
+
+# the specs of a machine, in dashboard column order
+FIELDS = ("is_online", "automation_status", "nixos_version", "nixos_version_match", "generation", "last_build")
+
+UNSET = "unset"
+
+
+class Record:
+    """
+    The specs of one machine. Slotted, so a record costs a few pointers
+    instead of a dict per machine.
+    """
+
+    __slots__ = FIELDS + ("version",)
+
+    def __init__(self):
+        for field in FIELDS:
+            setattr(self, field, UNSET)
+        # bumped on every change of this record
+        self.version = 0
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in FIELDS}
+
+
+class Store:
+    """
+    Machine specs and the remote version, shared between the scan and the
+    dashboard thread.
+
+    All reads and writes go through one lock, so a reader always sees a
+    record either before or after an update, never halfway. Every record
+    has its own version counter and the store one for all of them, so the
+    dashboard can tell cheaply whether a row or anything at all changed
+    since the last frame.
+    """
+
+    def __init__(self, machines=()):
+        self.lock = threading.Lock()
+        self.records: dict[str, Record] = {machine: Record() for machine in machines}
+        self.remote_version = UNSET
+        self.version = 0
+
+    def __contains__(self, machine):
+        return machine in self.records
+
+    def get(self, machine, field):
+        with self.lock:
+            return getattr(self.records[machine], field)
+
+    def specs(self, machine):
+        with self.lock:
+            return self.records[machine].as_dict()
+
+    def snapshot(self, machine):
+        """
+        Returns (version, specs) of `machine` as one consistent pair.
+        """
+        with self.lock:
+            record = self.records[machine]
+            return record.version, record.as_dict()
+
+    def update(self, machine, values):
+        """
+        Set several specs of `machine` at once, unknown keys are ignored.
+        Returns whether anything changed.
+        """
+        with self.lock:
+            record = self.records[machine]
+            changed = False
+            for field, value in values.items():
+                if field in FIELDS and getattr(record, field) != value:
+                    setattr(record, field, value)
+                    changed = True
+            if changed:
+                record.version += 1
+                self.version += 1
+            return changed
+
+    def set(self, machine, field, value):
+        return self.update(machine, {field: value})
+
+    def replace(self, machine, old, new, fields=FIELDS):
+        """
+        Set every spec of `machine` among `fields` that is `old` to `new`,
+        e.g. all unanswered queries to "timeout".
+        """
+        with self.lock:
+            record = self.records[machine]
+            fields = [field for field in fields if getattr(record, field) == old]
+            for field in fields:
+                setattr(record, field, new)
+            if fields:
+                record.version += 1
+                self.version += 1
+
+    def set_remote_version(self, version):
+        with self.lock:
+            if self.remote_version != version:
+                self.remote_version = version
+                self.version += 1
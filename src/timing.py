@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+import json
+import time
+
+from typing import NamedTuple
+
+# recording is switched on by --profile or --trace
+ENABLED = False
+
+ORIGIN = time.perf_counter()
+
+
+class Timing(NamedTuple):
+    host: str
+    query: str
+    start: float  # seconds since ORIGIN
+    end: float
+    status: str
+    # whether an ssh call went over an open master connection, None if it
+    # wasn't one
+    reused: bool | None = None
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+RECORDS: list[Timing] = []
+
+# statuses that don't count as failed calls in the report
+SUCCESS = ["ok", "0", "online", "offline"]
+
+
+class measure:
+    """
+    Record how long the enclosed block takes, usable around awaits:
+
+        with timing.measure(machine, "probe") as measurement:
+            output = await ...
+            measurement.status = output.returncode
+
+    The status defaults to "ok", or "timeout"/"cancelled"/"error" when the
+    block raises.
+    """
+
+    def __init__(self, host, query):
+        self.host = host
+        self.query = query
+        self.status = "ok"
+        self.reused = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        end = time.perf_counter()
+        if exception_type is not None:
+            if issubclass(exception_type, TimeoutError):
+                self.status = "timeout"
+            elif issubclass(exception_type, Exception):
+                self.status = "error"
+            else:
+                # asyncio.CancelledError, KeyboardInterrupt
+                self.status = "cancelled"
+        if ENABLED:
+            RECORDS.append(Timing(self.host, self.query, self.start - ORIGIN, end - ORIGIN, str(self.status), self.reused))
+        return False
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(int(fraction * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def report(records=None, top=10):
+    records = RECORDS if records is None else records
+    if not records:
+        return "no timings recorded"
+
+    lines = []
+    lines.append(f"{'query':<18} {'count':>6} {'p50 s':>8} {'p90 s':>8} {'p99 s':>8} {'max s':>8} {'failed':>7} {'reused':>7}")
+    queries = sorted({record.query for record in records})
+    for query in queries:
+        durations = sorted(record.duration for record in records if record.query == query)
+        failed = sum(1 for record in records if record.query == query and record.status not in SUCCESS)
+        reused = sum(1 for record in records if record.query == query and record.reused)
+        lines.append(f"{query:<18} {len(durations):>6} {percentile(durations, 0.5):>8.3f} {percentile(durations, 0.9):>8.3f} {percentile(durations, 0.99):>8.3f} {durations[-1]:>8.3f} {failed:>7} {reused:>7}")
+
+    lines.append("")
+    lines.append("slowest hosts (total seconds in queries)")
+    totals: dict[str, float] = {}
+    for record in records:
+        totals[record.host] = totals.get(record.host, 0.0) + record.duration
+    for host, total in sorted(totals.items(), key=lambda item: item[1], reverse=True)[:top]:
+        lines.append(f"  {total:>8.3f}  {host}")
+
+    lines.append("")
+    lines.append("slowest calls")
+    for record in sorted(records, key=lambda record: record.duration, reverse=True)[:top]:
+        lines.append(f"  {record.duration:>8.3f}  {record.host} {record.query} ({record.status})")
+
+    return "\n".join(lines)
+
+
+def write_trace(path, records=None):
+    """
+    Write the timings in the Chrome trace event format, which chrome://tracing
+    and Perfetto open directly. Every host gets its own track.
+    """
+    records = RECORDS if records is None else records
+    hosts = {host: index for index, host in enumerate(sorted({record.host for record in records}))}
+    events = [
+        {"name": "thread_name", "ph": "M", "pid": 1, "tid": index, "args": {"name": host}}
+        for host, index in hosts.items()
+        ]
+    for record in records:
+        arguments = {"host": record.host, "status": record.status}
+        if record.reused is not None:
+            arguments["reused"] = record.reused
+        events.append({
+            "name": record.query,
+            "cat": "fleet",
+            "ph": "X",
+            "pid": 1,
+            "tid": hosts[record.host],
+            "ts": round(record.start * 1e6),
+            "dur": round(record.duration * 1e6),
+            "args": arguments,
+            })
+    with open(path, "w") as trace_file:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace_file)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import termios
+import tty
+
+SORTS = ["name", "build-age", "generation", "version"]
+
+# key presses read from the terminal, see read_keys
+KEYS = {
+    b"j": "down", b"\033[B": "down",
+    b"k": "up", b"\033[A": "up",
+    b" ": "page down", b"\033[6~": "page down",
+    b"b": "page up", b"\033[5~": "page up",
+    b"g": "home", b"\033[H": "home",
+    b"G": "end", b"\033[F": "end",
+    b"s": "sort",
+    b"p": "problems",
+    }
+
+HELP = "j/k scroll · space/b page · s sort · p problems"
+
+
+class View:
+    """
+    Which slice of the machine list the dashboard shows, in which order.
+
+    Only the rows inside the window are rendered, so the cost of a frame
+    depends on the height of the terminal instead of the size of the fleet.
+    `changed` counts every change, so the renderer knows it has to redraw.
+    """
+
+    def __init__(self, sort="name", problems_only=False):
+        self.sort = sort
+        self.problems_only = problems_only
+        self.offset = 0
+        # rows of the last window, scrolling by pages moves by this much
+        self.page = 1
+        self.changed = 0
+
+    def window(self, machines, height):
+        """
+        The machines visible in a window of `height` rows, and the index of
+        the first one.
+        """
+        self.page = max(1, height)
+        self.offset = max(0, min(self.offset, len(machines) - height))
+        return self.offset, machines[self.offset:self.offset + height]
+
+    def press(self, key):
+        if key == "down":
+            self.offset += 1
+        elif key == "up":
+            self.offset = max(0, self.offset - 1)
+        elif key == "page down":
+            self.offset += self.page
+        elif key == "page up":
+            self.offset = max(0, self.offset - self.page)
+        elif key == "home":
+            self.offset = 0
+        elif key == "end":
+            self.offset = sys.maxsize  # clamped by the next window
+        elif key == "sort":
+            self.sort = SORTS[(SORTS.index(self.sort) + 1) % len(SORTS)]
+            self.offset = 0
+        elif key == "problems":
+            self.problems_only = not self.problems_only
+            self.offset = 0
+        else:
+            return
+        self.changed += 1
+
+    def status(self, start, shown, total):
+        sort = self.sort.replace("-", " ")
+        problems = " · problems only" if self.problems_only else ""
+        if shown:
+            rows = f"{start + 1}-{start + shown} of {total}"
+        else:
+            rows = f"0 of {total}"
+        return f" {rows} · sort: {sort}{problems} · {HELP}"
+
+
+def terminal_height(stream):
+    """
+    Lines available for the dashboard, None if `stream` isn't a terminal.
+    """
+    try:
+        if not stream.isatty():
+            return None
+        lines = os.get_terminal_size(stream.fileno()).lines
+    except (AttributeError, ValueError, OSError):
+        return None
+    # the cursor rests on the line below the last one
+    return lines - 1
+
+
+def read_keys(view, stream=None):
+    """
+    Feed key presses on the terminal to `view` until stdin closes, meant to
+    run in a daemon thread. Returns right away if stdin isn't a terminal.
+    """
+    stream = stream or sys.stdin
+    if not stream.isatty():
+        return
+
+    descriptor = stream.fileno()
+    attributes = termios.tcgetattr(descriptor)
+    tty.setcbreak(descriptor)
+    try:
+        while True:
+            data = os.read(descriptor, 8)
+            if not data:
+                return
+            key = KEYS.get(data)
+            if key is not None:
+                view.press(key)
+    finally:
+        termios.tcsetattr(descriptor, termios.TCSADRAIN, attributes)
+
+
+def restore_terminal(stream=None):
+    """
+    Leave cbreak mode, the key reader thread doesn't get to when the
+    program exits.
+    """
+    stream = stream or sys.stdin
+    if stream.isatty():
+        attributes = termios.tcgetattr(stream.fileno())
+        attributes[3] |= termios.ECHO | termios.ICANON
+        termios.tcsetattr(stream.fileno(), termios.TCSADRAIN, attributes)